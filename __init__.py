@@ -6,31 +6,48 @@ __license__ = 'MIT'
 
 # Locally needed imports
 from semaver import Version as _Version
-from pytsite import cache as _cache
+from pytsite import cache as _pytsite_cache
 
-# This cache pool MUST be created before any imports
-_cache.create_pool('odm.entities')
+# These cache pools MUST be created before any imports
+_pytsite_cache.create_pool('odm.entities')
+_pytsite_cache.create_pool('odm.metrics')
 
 # Public API
-from . import _field as field, _validation as validation, _error as error, _model as model
+from . import _field as field, _validation as validation, _error as error, _model as model, _metrics as metrics
 from ._model import Entity, I_ASC, I_DESC, I_TEXT, I_GEO2D, I_GEOSPHERE
 from ._finder import Finder, SingleModelFinder, MultiModelFinder, SingleModelResult, MultiModelResult
+from ._cache import CacheBroker, LocalCacheBroker, set_cache_broker, get_cache_broker
 from ._api import register_model, unregister_model, is_model_registered, get_model_class, get_registered_models, \
-    resolve_ref, resolve_refs, get_by_ref, dispense, find, mfind, aggregate, clear_cache, reindex, on_model_register, \
-    on_model_setup_fields, on_model_setup_indexes, on_entity_pre_save, on_entity_save, on_entity_pre_delete, \
-    on_entity_delete, on_cache_clear
+    resolve_ref, resolve_refs, get_by_ref, get_by_refs, dispense, dispense_many, get_schema, find, mfind, aggregate, \
+    session, clear_cache, reindex, on_model_register, on_model_setup_fields, on_model_setup_indexes, \
+    on_entity_pre_save, on_entity_save, on_entity_pre_delete, on_entity_delete, on_cache_clear
 
 
 def plugin_load():
-    from pytsite import console, events
+    from pytsite import console, events, reg
     from . import _cc, _eh
 
     # Console commands
     console.register_command(_cc.Reindex())
+    console.register_command(_cc.CacheStats())
+
+    # Cache metrics, flushed after requests and on exit to be shown by the console command
+    if reg.get('odm.metrics', False):
+        import atexit
+        from pytsite import router
+        metrics.set_collector(metrics.MemoryCollector())
+        router.on_response(_eh.flush_metrics)
+        atexit.register(metrics.flush, True)
 
     # Event listeners
     events.listen('pytsite.mongodb@restore', _eh.db_restore)
 
+    # Identity map session for each request
+    if reg.get('odm.identity_map', False):
+        from pytsite import router
+        router.on_dispatch(_eh.router_dispatch)
+        router.on_response(_eh.router_response)
+
 
 def plugin_update(v_from: _Version):
     from pytsite import console
@@ -56,7 +73,7 @@ def plugin_update(v_from: _Version):
         for m in get_registered_models():
             console.print_info("Processing model '{}'".format(m))
             fields_to_update = []
-            for f in dispense(m).fields.values():
+            for f in get_schema(m).fields.values():
                 if f.name != '_parent' and isinstance(f, (field.Ref, field.RefsList)):
                     fields_to_update.append(f.name)
 
@@ -20,7 +20,8 @@ class Aggregator:
         """Init
         """
         self._model = model
-        self._mock = _api.dispense(model)
+        self._schema = _api.get_schema(model)
+        self._mock = None
         self._pipeline = []
 
     @property
@@ -33,8 +34,17 @@ class Aggregator:
     def mock(self) -> _model.Entity:
         """Get mock of the aggregator
         """
+        if self._mock is None:
+            self._mock = _api.dispense(self._model)
+
         return self._mock
 
+    @property
+    def schema(self) -> _model.Schema:
+        """Get schema of the aggregator's model
+        """
+        return self._schema
+
     @property
     def pipeline(self) -> list:
         """Get pipeline of the aggregator
@@ -46,7 +56,7 @@ class Aggregator:
 
         https://docs.mongodb.com/manual/reference/operator/aggregation/match/
         """
-        self._pipeline.append(('$match', _odm_query.ODMQuery(self._mock, op).compile()))
+        self._pipeline.append(('$match', _odm_query.ODMQuery(self._schema, op).compile()))
 
         return self
 
@@ -99,7 +109,7 @@ class Aggregator:
     def get(self) -> CommandCursor:
         """Perform aggregation operation and get cursor
         """
-        return self._mock.collection.aggregate(self._compile())
+        return self._schema.collection.aggregate(self._compile())
 
     def __iter__(self):
         return self.get()
@@ -4,19 +4,21 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from typing import Union, Optional, List, Tuple, Type
+from typing import Union, Optional, List, Tuple, Type, Iterable, Dict
+from threading import local
+from contextlib import contextmanager
 from bson import errors as bson_errors
 from bson.dbref import DBRef
 from bson.objectid import ObjectId
 from pymongo.collection import Collection
 from pytsite import mongodb, util, events, cache, lang, console
 from plugins.query import Query
-from . import _model, _error, _finder
+from . import _model, _error, _finder, _cache, _metrics
 
-_ENTITIES_CACHE = cache.get_pool('odm.entities')
 _MODEL_TO_CLASS = {}
 _MODEL_TO_COLLECTION = {}
 _COLLECTION_NAME_TO_MODEL = {}
+_SESSION = local()
 
 
 def register_model(model: str, cls: Union[str, Type[_model.Entity]], replace: bool = False):
@@ -37,6 +39,7 @@ def register_model(model: str, cls: Union[str, Type[_model.Entity]], replace: bo
         cache.create_pool('odm.finder.' + model)
 
     _MODEL_TO_CLASS[model] = cls
+    _model.reset_schema(model)
 
     cls.on_register(model)
     events.fire('odm@model.register', model=model, cls=cls, replace=replace)
@@ -59,6 +62,7 @@ def unregister_model(model: str):
         raise _error.ModelNotRegistered(model)
 
     del _MODEL_TO_CLASS[model]
+    _model.reset_schema(model)
 
 
 def is_model_registered(model: str) -> bool:
@@ -144,13 +148,181 @@ def resolve_refs(something: Union[list, tuple]) -> List[str]:
     return [resolve_ref(v) for v in something]
 
 
+def _get_session() -> Optional[Dict[Tuple[str, ObjectId], _model.Entity]]:
+    """Get identity map of current thread's session
+    """
+    return getattr(_SESSION, 'entities', None)
+
+
+def begin_session():
+    """Begin identity map session in current thread
+
+    While the session is active, each stored entity is dispensed as a single object.
+    """
+    _SESSION.entities = {}
+
+
+def end_session():
+    """End identity map session in current thread
+    """
+    _SESSION.entities = None
+
+
+@contextmanager
+def session():
+    """Identity map session context manager
+
+    Nested sessions share the identity map of the outer one.
+    """
+    if _get_session() is not None:
+        yield
+        return
+
+    begin_session()
+    try:
+        yield
+    finally:
+        end_session()
+
+
+def session_put(entity: _model.Entity):
+    """Put an entity into identity map of current session
+    """
+    entities = _get_session()
+    if entities is not None and not entity.is_new:
+        entities[(entity.model, entity.id)] = entity
+
+
+def session_rm(entity: _model.Entity):
+    """Remove an entity from identity map of current session
+    """
+    entities = _get_session()
+    if entities is not None:
+        entities.pop((entity.model, entity.id), None)
+
+
 def dispense(model: str, eid: Union[int, str, ObjectId, None] = None) -> _model.Entity:
     """Dispense an entity
     """
     if not is_model_registered(model):
         raise _error.ModelNotRegistered(model)
 
-    return get_model_class(model)(model, None if eid in (0, '0') else eid)
+    if eid in (0, '0'):
+        eid = None
+
+    entities = _get_session()
+    if entities is None or not eid:
+        return get_model_class(model)(model, eid)
+
+    try:
+        key = (model, ObjectId(eid) if isinstance(eid, str) else eid)
+    except bson_errors.InvalidId:
+        return get_model_class(model)(model, eid)
+
+    if key not in entities:
+        entities[key] = get_model_class(model)(model, eid)
+
+    return entities[key]
+
+
+def dispense_from_data(model: str, data: dict, projection: dict = None) -> _model.Entity:
+    """Dispense an entity using already loaded document's data
+
+    Loaded data is also put into the entities cache, unless it has been loaded using a `projection`, i. e. contains
+    only some of the fields. Fields excluded by the projection are loaded on first access.
+    """
+    if not is_model_registered(model):
+        raise _error.ModelNotRegistered(model)
+
+    # Entity already dispensed in current session is reused as is
+    entities = _get_session()
+    if entities is not None and (model, data['_id']) in entities:
+        return entities[(model, data['_id'])]
+
+    entity = get_model_class(model)(model)
+    entity._fill_fields_data(data, projection)
+
+    if not projection:
+        _cache.put_entity(model, data)
+
+    if entities is not None:
+        entities[(model, data['_id'])] = entity
+
+    return entity
+
+
+def dispense_many(model: str, eids: Iterable[Union[str, ObjectId]], skip_missing: bool = False) -> List[_model.Entity]:
+    """Dispense multiple entities
+
+    Data is taken from the entities cache, all missed documents are loaded from the database using a single query.
+    Order of entities is the same as order of IDs. If `skip_missing` is True, nonexistent entities are omitted instead
+    of raising EntityNotFound.
+    """
+    if not is_model_registered(model):
+        raise _error.ModelNotRegistered(model)
+
+    eids = [ObjectId(eid) if isinstance(eid, str) else eid for eid in eids]
+
+    # Take entities already dispensed in current session
+    session_entities = _get_session()
+    entities = {}
+    if session_entities is not None:
+        for eid in eids:
+            if (model, eid) in session_entities:
+                entities[eid] = session_entities[(model, eid)]
+
+    # Load data from cache
+    generation = _cache.get_generation(model)
+    cached = _cache.get_entities(model, [eid for eid in eids if eid not in entities], generation)
+    data = {eid: d for eid, d in cached.items() if d is not None}
+
+    # Load missed data from the database, entities remembered as nonexistent are not loaded
+    misses = [eid for eid in eids if eid not in cached and eid not in entities]
+    if misses:
+        _metrics.incr('entity.db_load', model, len(misses))
+        with _metrics.timer('entity.db_time', model):
+            docs = list(get_model_collection(model).find({'_id': {'$in': misses}}))
+
+        for doc in docs:
+            _cache.put_entity(model, doc, generation)
+            data[doc['_id']] = doc
+
+        for eid in misses:
+            if eid not in data:
+                _cache.put_missing(model, eid, generation)
+
+    r = []
+    model_cls = get_model_class(model)
+    for eid in eids:
+        if eid in entities:
+            r.append(entities[eid])
+            continue
+
+        if eid not in data:
+            if skip_missing:
+                continue
+            raise _error.EntityNotFound(model, str(eid))
+
+        entity = model_cls(model)
+        entity._fill_fields_data(data[eid])
+        r.append(entity)
+
+        if session_entities is not None:
+            session_entities[(model, eid)] = entities[eid] = entity
+
+    return r
+
+
+def get_schema(model: str) -> _model.Schema:
+    """Get model's schema to use as a read-only mock
+    """
+    try:
+        return _model._SCHEMAS[model]
+    except KeyError:
+        entity = dispense(model)
+
+        # Schema is not cached for some models
+        return _model._SCHEMAS.get(model) or _model.Schema(entity)
 
 
 def get_by_ref(ref: Union[None, str, _model.Entity, DBRef]) -> Optional[_model.Entity]:
@@ -159,6 +331,30 @@ def get_by_ref(ref: Union[None, str, _model.Entity, DBRef]) -> Optional[_model.E
     return dispense(*resolve_ref(ref, False)) if ref else None
 
 
+def get_by_refs(refs: Iterable[Union[str, _model.Entity, DBRef]], skip_missing: bool = False) -> List[_model.Entity]:
+    """Get entities by references
+
+    Entities are loaded by models, see dispense_many(). Order of entities is the same as order of references.
+    """
+    resolved = []
+    by_model = {}
+    for ref in refs:
+        parts = resolve_ref(ref, False)
+        if not parts:
+            raise _error.InvalidReference(ref)
+
+        model, uid = parts[0], ObjectId(parts[1]) if isinstance(parts[1], str) else parts[1]
+        resolved.append((model, uid))
+        by_model.setdefault(model, []).append(uid)
+
+    entities = {}
+    for model, uids in by_model.items():
+        for entity in dispense_many(model, uids, skip_missing):
+            entities[(model, entity.id)] = entity
+
+    return [entities[k] for k in resolved if k in entities]
+
+
 def reindex(model: str = None):
     """Reindex model(s)'s collection
     """
@@ -189,20 +385,18 @@ def aggregate(model: str):
 
 
 def clear_cache(model: str):
-    """Get finder cache pool
+    """Clear model's entities and finder cache
+
+    Cached data is not removed, but a new generation of model's cache keys is started, see _cache.bump_generation().
     """
-    try:
-        # Clear finder cache
-        cache.get_pool('odm.finder.' + model).clear()
+    # Invalidate resolved references to model's entities
+    _model.bump_version(model)
 
-        # Cleanup entities cache
-        for k in _ENTITIES_CACHE.keys():
-            if k.startswith(model + '.'):
-                _ENTITIES_CACHE.rm(k)
+    # Invalidate entities and finder cache
+    _cache.bump_generation(model)
+    _metrics.incr('cache.clear', model)
 
-        events.fire('odm@cache.clear', model=model)
-    except cache.error.PoolNotExist:
-        pass
+    events.fire('odm@cache.clear', model=model)
 
 
 def on_model_register(handler, priority: int = 0):
@@ -211,16 +405,31 @@ def on_model_register(handler, priority: int = 0):
     events.listen('odm@model.register', handler, priority)
 
 
-def on_model_setup_fields(handler, priority: int = 0):
+def on_model_setup_fields(handler, priority: int = 0, model: str = None):
     """Shortcut
+
+    If `model` is specified, the handler is called only for the model. Models' schemas are built once, so handlers
+    of the 'odm@model.setup_fields' events must be added via this function, otherwise they are called only for
+    models which schemas are not built yet.
     """
-    events.listen('odm@model.setup_fields', handler, priority)
+    events.listen('odm@model.setup_fields.{}'.format(model) if model else 'odm@model.setup_fields', handler, priority)
+
+    # Schemas built before the handler was added are not valid anymore
+    _model.reset_schema(model)
 
 
-def on_model_setup_indexes(handler, priority: int = 0):
+def on_model_setup_indexes(handler, priority: int = 0, model: str = None):
     """Shortcut
+
+    If `model` is specified, the handler is called only for the model. Models' schemas are built once, so handlers
+    of the 'odm@model.setup_indexes' events must be added via this function, otherwise they are called only for
+    models which schemas are not built yet.
     """
-    events.listen('odm@model.setup_indexes', handler, priority)
+    events.listen('odm@model.setup_indexes.{}'.format(model) if model else 'odm@model.setup_indexes', handler,
+                  priority)
+
+    # Schemas built before the handler was added are not valid anymore
+    _model.reset_schema(model)
 
 
 def on_entity_pre_save(handler, priority: int = 0):
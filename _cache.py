@@ -0,0 +1,535 @@
+"""PytSite ODM Plugin Cache Helpers
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Dict, Iterable, Any, Optional, Callable, Hashable
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+from time import time, sleep
+from datetime import datetime
+from zlib import compress, decompress
+from bson import BSON, ObjectId, json_util
+from pytsite import cache, reg
+from . import _metrics
+
+_ENTITIES_CACHE = cache.get_pool('odm.entities')
+_CACHE_TTL = reg.get('odm.cache_ttl', 86400)
+_GENERATION_CHECK_INTERVAL = 0  # Set by set_cache_broker()
+_GENERATIONS = {}  # Model's generation and time of its last check by models
+_CACHE_FORMAT = reg.get('odm.cache_format', 'hash')
+_CACHE_COMPRESS_THRESHOLD = reg.get('odm.cache_compress_threshold', 4096)
+_CACHE_NEGATIVE_TTL = reg.get('odm.cache_negative_ttl', 60)
+_TOMBSTONE = {'$missing': True}  # Data stored instead of nonexistent entity's one, never a valid document
+_LOCK_TTL = reg.get('odm.finder_lock_ttl', 30)
+_LOCK_TIMEOUT = reg.get('odm.finder_lock_timeout', 2)
+_LOCK_POLL_INTERVAL = 0.05
+_HELD_LOCKS = set()
+_HELD_LOCKS_LOCK = Lock()
+
+
+class LRUCache:
+    """Bounded in-process cache which evicts least recently used and expired items
+    """
+
+    def __init__(self, size: int, ttl: int):
+        self._size = size
+        self._ttl = ttl
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Any:
+        """Get an item, None if it does not exist or expired
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+
+            value, expires = item
+            if expires < time():
+                del self._items[key]
+                return None
+
+            self._items.move_to_end(key)
+
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        """Put an item
+        """
+        with self._lock:
+            self._items[key] = (value, time() + self._ttl)
+            self._items.move_to_end(key)
+
+            if len(self._items) > self._size:
+                self._items.popitem(False)
+
+    def rm(self, key: Hashable):
+        """Remove an item
+        """
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        """Remove all items
+        """
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class CacheBroker(ABC):
+    """Channel which delivers cache invalidation messages to all processes
+    """
+
+    @abstractmethod
+    def publish(self, message: dict):
+        """Deliver a message to all subscribers
+        """
+        pass
+
+    @abstractmethod
+    def subscribe(self, handler: Callable[[dict], None]):
+        """Subscribe to messages
+        """
+        pass
+
+
+class LocalCacheBroker(CacheBroker):
+    """Broker which delivers messages to subscribers of current process only
+    """
+
+    def __init__(self):
+        self._handlers = []
+
+    def publish(self, message: dict):
+        for handler in self._handlers:
+            handler(message)
+
+    def subscribe(self, handler: Callable[[dict], None]):
+        self._handlers.append(handler)
+
+
+# Local cache of entities' data, in front of the entities cache pool, enabled by set_cache_broker()
+_LOCAL_CACHE_SIZE = reg.get('odm.local_cache_size', 0)
+_LOCAL_CACHE_TTL = reg.get('odm.local_cache_ttl', 60)
+_LOCAL_CACHE = None  # type: Optional[LRUCache]
+_BROKER = None  # type: CacheBroker
+
+
+def _on_broker_message(message: dict):
+    """Invalidate local cache
+    """
+    if 'generation' in message:
+        _GENERATIONS.pop(message['model'], None)
+
+    if 'eid' in message and _LOCAL_CACHE is not None:
+        _LOCAL_CACHE.rm((message['model'], message['eid']))
+
+
+def set_cache_broker(broker: CacheBroker, cross_process: bool = False):
+    """Set broker which delivers invalidation messages of local cache
+
+    `cross_process` must be True only if the broker delivers messages to all processes of the application. Local cache
+    is enabled by the `odm.local_cache_size` registry option only for such a broker, because otherwise local caches of
+    other processes could not be invalidated. For the same reason `odm.cache_generation_check_interval` defaults to
+    one second for such a broker and to zero otherwise.
+    """
+    global _BROKER, _LOCAL_CACHE, _GENERATION_CHECK_INTERVAL
+
+    _BROKER = broker
+    broker.subscribe(_on_broker_message)
+
+    # Generations are memoized by default only if other processes are notified about their changes
+    _GENERATION_CHECK_INTERVAL = reg.get('odm.cache_generation_check_interval', 1 if cross_process else 0)
+
+    # Local cache is started from scratch, because messages could not be delivered while the broker was changed
+    if _LOCAL_CACHE_SIZE and cross_process:
+        _LOCAL_CACHE = LRUCache(_LOCAL_CACHE_SIZE, _LOCAL_CACHE_TTL)
+    else:
+        _LOCAL_CACHE = None
+
+
+def get_cache_broker() -> CacheBroker:
+    """Get broker which delivers invalidation messages of local cache
+    """
+    return _BROKER
+
+
+def get_local_cache() -> Optional[LRUCache]:
+    """Get local cache of entities' data, None if it is disabled
+    """
+    return _LOCAL_CACHE
+
+
+def _local_get(model: str, eid: Any, generation: str) -> Optional[dict]:
+    if _LOCAL_CACHE is None:
+        return None
+
+    # Data is stored encoded, so each reader gets its own copy
+    item = _LOCAL_CACHE.get((model, str(eid)))
+    if item and item[0] == generation:
+        return BSON(item[1]).decode()
+
+    return None
+
+
+def _local_put(model: str, eid: Any, generation: str, data: dict):
+    if _LOCAL_CACHE is not None:
+        _LOCAL_CACHE.put((model, str(eid)), (generation, BSON.encode(data)))
+
+
+def _generation_key(model: str) -> str:
+    return '{}.generation'.format(model)
+
+
+def _tags_key(model: str, generation: str = None) -> str:
+    return '{}.{}.tags'.format(model, generation or get_generation(model))
+
+
+def _get_tags(model: str, generation: str = None) -> Dict[str, str]:
+    try:
+        return _ENTITIES_CACHE.get_hash(_tags_key(model, generation))
+    except cache.error.KeyNotExist:
+        return {}
+
+
+def _new_token() -> str:
+    # Tokens are based on current time, so they never repeat, even if stored ones have been evicted
+    return format(int(time() * 1000000), 'x')
+
+
+def bump_generation(model: str) -> str:
+    """Start new generation of model's cache keys
+
+    Keys of previous generations are never read again and expire by their TTL.
+    """
+    generation = _new_token()
+    _ENTITIES_CACHE.put(_generation_key(model), generation)
+    _BROKER.publish({'model': model, 'generation': generation})
+    _GENERATIONS[model] = (generation, time())
+
+    return generation
+
+
+def get_generation(model: str) -> str:
+    """Get current generation of model's cache keys
+
+    Generation is checked in the cache not more often than once per `odm.cache_generation_check_interval` seconds,
+    so other processes may use previous generation during this interval after the cache has been cleared, unless the
+    cache broker notifies them. Zero interval makes the check on every call, see set_cache_broker().
+    """
+    if model in _GENERATIONS:
+        generation, checked = _GENERATIONS[model]
+        if time() - checked < _GENERATION_CHECK_INTERVAL:
+            return generation
+
+    try:
+        generation = _ENTITIES_CACHE.get(_generation_key(model))
+        _GENERATIONS[model] = (generation, time())
+    except cache.error.KeyNotExist:
+        generation = bump_generation(model)
+
+    return generation
+
+
+def entity_key(model: str, eid: Any, generation: str = None) -> str:
+    """Get cache key of entity's data
+
+    Keys of different cache formats never intersect, so the format can be changed without clearing the cache.
+    """
+    key = '{}.{}.{}'.format(model, generation or get_generation(model), eid)
+
+    return key + '.bson' if _CACHE_FORMAT == 'bson' else key
+
+
+def encode_blob(data: dict) -> bytes:
+    """Encode entity's data as a BSON blob, compressed if it is larger than `odm.cache_compress_threshold` bytes
+    """
+    blob = BSON.encode(data)
+    if _CACHE_COMPRESS_THRESHOLD and len(blob) > _CACHE_COMPRESS_THRESHOLD:
+        return b'z' + compress(blob)
+
+    return b'b' + blob
+
+
+def decode_blob(blob: bytes) -> dict:
+    """Decode entity's data encoded by encode_blob()
+    """
+    return BSON(decompress(blob[1:]) if blob[:1] == b'z' else blob[1:]).decode()
+
+
+def _pool_get(model: str, key: str) -> Optional[dict]:
+    with _metrics.timer('entity.cache_time', model):
+        try:
+            if _CACHE_FORMAT == 'bson':
+                blob = _ENTITIES_CACHE.get(key)
+                _metrics.incr('entity.bytes_read', model, len(blob))
+                data = decode_blob(blob)
+            else:
+                data = _ENTITIES_CACHE.get_hash(key)
+        except cache.error.KeyNotExist:
+            _metrics.incr('entity.miss', model)
+            raise
+
+    if data == _TOMBSTONE:
+        _metrics.incr('entity.negative_hit', model)
+        return None
+
+    _metrics.incr('entity.hit', model)
+
+    return data
+
+
+def _pool_put(model: str, key: str, data: dict, ttl: int = None):
+    if _CACHE_FORMAT == 'bson':
+        blob = encode_blob(data)
+        _metrics.incr('entity.bytes_written', model, len(blob))
+        _ENTITIES_CACHE.put(key, blob, ttl or _CACHE_TTL)
+    else:
+        _ENTITIES_CACHE.put_hash(key, data, ttl or _CACHE_TTL)
+
+
+def finder_key(model: str, key: str, generation: str = None) -> str:
+    """Get cache key of finder's data
+    """
+    return '{}.{}'.format(generation or get_generation(model), key)
+
+
+def field_tag(name: str) -> str:
+    """Get tag of finder cache entries which depend on a field
+    """
+    return 'f:' + name.split('.')[0]
+
+
+def eq_tag(name: str, value: Any) -> str:
+    """Get tag of finder cache entries which match only entities having specified value of a field
+    """
+    # MongoDB considers numbers of different types as equal
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = float(value)
+
+    return 'eq:{}:{}'.format(name, json_util.dumps(value))
+
+
+def is_eq_tag_value(value: Any) -> bool:
+    """Check if an eq_tag() can be built for the value
+    """
+    return value is None or isinstance(value, (str, int, float, bool, ObjectId, datetime))
+
+
+def get_tags_tokens(model: str, tags: Iterable[str], ttl: int, generation: str = None) -> Dict[str, str]:
+    """Get current tokens of finder cache entries tags
+
+    Must be called BEFORE querying the database, so any change made after that invalidates the tokens. Missing tokens
+    are created.
+    """
+    r = {}
+    key = _tags_key(model, generation)
+    current = _get_tags(model, generation)
+    for tag in tags:
+        token = current.get(tag)
+        if token is None:
+            token = _new_token()
+            _ENTITIES_CACHE.put_hash_item(key, tag, token, ttl)
+        r[tag] = token
+
+    return r
+
+
+def put_entry(pool: cache.Pool, key: str, entry: dict, tokens: Dict[str, str], ttl: int, stale_ttl: int = 0):
+    """Put a finder cache entry
+
+    Entry expires in `ttl` seconds, but it is kept in the pool `stale_ttl` seconds longer to be served as stale.
+    """
+    entry.update({'tokens': tokens or {}, 'expires': time() + ttl})
+    pool.put(key, entry, ttl + stale_ttl)
+
+
+def get_entry(pool: cache.Pool, key: str) -> Optional[dict]:
+    """Get a finder cache entry, valid or not
+    """
+    try:
+        entry = pool.get(key)
+    except cache.error.KeyNotExist:
+        return None
+
+    return entry if isinstance(entry, dict) and 'tokens' in entry else None
+
+
+def is_entry_valid(model: str, entry: Optional[dict], generation: str = None) -> bool:
+    """Check if a finder cache entry is not expired and none of its tags was invalidated since it has been built
+    """
+    if not isinstance(entry, dict) or 'tokens' not in entry or entry.get('expires', 0) < time():
+        return False
+
+    if not entry['tokens']:
+        return True
+
+    current = _get_tags(model, generation)
+
+    return all(current.get(tag) == token for tag, token in entry['tokens'].items())
+
+
+def invalidate_entity(model: str, data: dict = None, fields: Iterable[str] = ()):
+    """Invalidate finder cache entries which could be affected by a change of an entity
+
+    `data` is a storable data of inserted or deleted entity, `fields` are names of modified fields of updated entity.
+    """
+    tags = ['*']
+
+    # Inserted or deleted entity could match queries without equality condition and ones with equal field's value
+    if data is not None:
+        tags.append('$any')
+        tags.extend(eq_tag(k, v) for k, v in data.items() if is_eq_tag_value(v))
+
+    # Modified entity could change results of queries which refer the fields
+    tags.extend(field_tag(f_name) for f_name in fields)
+    _metrics.incr('finder.invalidated_tags', model, len(tags))
+
+    key = _tags_key(model)
+    for tag in tags:
+        _ENTITIES_CACHE.rm_hash_item(key, tag)
+
+
+def acquire_lock(pool: cache.Pool, key: str) -> bool:
+    """Try to acquire a lock on building of a finder cache entry
+
+    The lock is best effort: the cache pool cannot check and set a key atomically, so only workers of current process
+    are excluded reliably. Lock expires in `odm.finder_lock_ttl` seconds, if the owner didn't release it.
+    """
+    with _HELD_LOCKS_LOCK:
+        if key in _HELD_LOCKS or pool.has(key + '.lock'):
+            return False
+
+        _HELD_LOCKS.add(key)
+
+    pool.put(key + '.lock', True, _LOCK_TTL)
+
+    return True
+
+
+def is_lock_held(key: str) -> bool:
+    """Check if a lock on building of a finder cache entry is held by current process
+    """
+    with _HELD_LOCKS_LOCK:
+        return key in _HELD_LOCKS
+
+
+def release_lock(pool: cache.Pool, key: str):
+    """Release a lock on building of a finder cache entry
+    """
+    pool.rm(key + '.lock')
+
+    with _HELD_LOCKS_LOCK:
+        _HELD_LOCKS.discard(key)
+
+
+def wait_entry(pool: cache.Pool, model: str, key: str, generation: str = None) -> Optional[dict]:
+    """Wait until other worker builds a finder cache entry
+
+    Returns None if the entry is not built in `odm.finder_lock_timeout` seconds or the lock has been released without
+    building it.
+    """
+    deadline = time() + _LOCK_TIMEOUT
+    while time() < deadline:
+        sleep(_LOCK_POLL_INTERVAL)
+
+        # Lock must be checked before the entry, because the entry is put before the lock is released
+        is_locked = pool.has(key + '.lock')
+
+        entry = get_entry(pool, key)
+        if is_entry_valid(model, entry, generation):
+            return entry
+
+        if not is_locked:
+            break
+
+    return None
+
+
+def get_entity(model: str, eid: Any, generation: str = None) -> Optional[dict]:
+    """Get entity's data from the local cache or the entities cache pool
+
+    Returns None if the entity is remembered as nonexistent.
+    """
+    generation = generation or get_generation(model)
+
+    data = _local_get(model, eid, generation)
+    if data is None:
+        data = _pool_get(model, entity_key(model, eid, generation))
+        if data is not None:
+            _local_put(model, eid, generation, data)
+    else:
+        _metrics.incr('entity.local_hit', model)
+
+    return data
+
+
+def get_entities(model: str, eids: Iterable[Any], generation: str = None) -> Dict[Any, dict]:
+    """Get data of multiple entities from the local cache or the entities cache pool
+
+    Data of entities missed in the cache is omitted, data of entities remembered as nonexistent is None.
+    """
+    r = {}
+    generation = generation or get_generation(model)
+    for eid in eids:
+        data = _local_get(model, eid, generation)
+        if data is None:
+            try:
+                data = _pool_get(model, entity_key(model, eid, generation))
+            except cache.error.KeyNotExist:
+                continue
+
+            if data is not None:
+                _local_put(model, eid, generation, data)
+        else:
+            _metrics.incr('entity.local_hit', model)
+
+        r[eid] = data
+
+    return r
+
+
+def put_entity(model: str, data: dict, generation: str = None):
+    """Put entity's data into the cache
+    """
+    generation = generation or get_generation(model)
+    _pool_put(model, entity_key(model, data['_id'], generation), data)
+    _local_put(model, data['_id'], generation, data)
+
+
+def rm_entity(model: str, eid: Any, generation: str = None):
+    """Remove data of deleted entity from the cache
+
+    Data is replaced by a tombstone, if nonexistent entities are remembered.
+    """
+    if _CACHE_NEGATIVE_TTL:
+        put_missing(model, eid, generation)
+    else:
+        _ENTITIES_CACHE.rm(entity_key(model, eid, generation))
+
+    publish_entity_change(model, eid)
+
+
+def put_missing(model: str, eid: Any, generation: str = None):
+    """Remember that an entity does not exist for `odm.cache_negative_ttl` seconds
+
+    A tombstone is stored under the entity's key, so get_entity() and get_entities() report the entity as nonexistent.
+    """
+    if _CACHE_NEGATIVE_TTL:
+        _pool_put(model, entity_key(model, eid, generation), _TOMBSTONE, _CACHE_NEGATIVE_TTL)
+
+
+def publish_entity_change(model: str, eid: Any):
+    """Notify all processes that entity's data is changed, so they will remove it from their local caches
+    """
+    _BROKER.publish({'model': model, 'eid': str(eid)})
+
+
+set_cache_broker(LocalCacheBroker())
@@ -4,8 +4,8 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from pytsite import console, maintenance
-from . import _api
+from pytsite import console, maintenance, lang
+from . import _api, _metrics
 
 
 class Reindex(console.Command):
@@ -41,3 +41,62 @@ class Reindex(console.Command):
 
         if not no_maint:
             maintenance.disable()
+
+
+class CacheStats(console.Command):
+    """Cache Statistics Command.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.define_option(console.option.Bool('finders'))
+        self.define_option(console.option.Bool('reset'))
+
+    @property
+    def name(self) -> str:
+        """Get name of the command.
+        """
+        return 'odm:cache-stats'
+
+    @property
+    def description(self) -> str:
+        """Get description of the command.
+        """
+        return 'odm@console_command_description_cache_stats'
+
+    def exec(self):
+        """Execute the command.
+        """
+        # Console process serves no requests, so metrics flushed by all processes are shown
+        collector = _metrics.aggregate()
+        if collector is None:
+            console.print_warning(lang.t('odm@cache_stats_not_collected'))
+            return
+
+        # Metrics of finders are summed up by models, unless the opposite is requested
+        with_finders = self.opt('finders')
+        rows = {}
+        for (name, model, finder), value in collector.get_counters().items():
+            key = (model, finder if with_finders else None)
+            rows.setdefault(key, {})
+            rows[key][name] = rows[key].get(name, 0) + value
+
+        for (name, model, finder), h in collector.get_histograms().items():
+            key = (model, finder if with_finders else None)
+            rows.setdefault(key, {})
+            prev = rows[key].get(name, (0, 0.0))
+            rows[key][name] = (prev[0] + h['count'], prev[1] + h['sum'])
+
+        for (model, finder), metrics in sorted(rows.items(), key=lambda r: (r[0][0], r[0][1] or '')):
+            console.print_info('{}{}'.format(model, ' ' + finder if finder else ''))
+            for name, value in sorted(metrics.items()):
+                if isinstance(value, tuple):
+                    value = lang.t('odm@cache_stats_timing', {
+                        'count': value[0],
+                        'avg': '{:.2f}'.format(value[1] / value[0] * 1000 if value[0] else 0),
+                    })
+                console.print_info('    {}: {}'.format(name, value))
+
+        if self.opt('reset'):
+            _metrics.reset_all()
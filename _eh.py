@@ -2,10 +2,22 @@
 """
 
 from pytsite import console, lang
-from . import _api
+from . import _api, _metrics
 
 
 def db_restore():
     for model in _api.get_registered_models():
         _api.clear_cache(model)
         console.print_info(lang.t('odm@cache_cleared', {'model': model}))
+
+
+def router_dispatch(**kwargs):
+    _api.begin_session()
+
+
+def router_response(**kwargs):
+    _api.end_session()
+
+
+def flush_metrics(**kwargs):
+    _metrics.flush()
@@ -127,3 +127,16 @@ class RequiredFieldEmpty(Error):
 
     def __str__(self) -> str:
         return "Field '{}.{}' cannot be empty".format(self._model, self._field_name)
+
+
+class InvalidSeekToken(Error):
+    """Invalid finder's seek continuation token exception
+    """
+
+    def __init__(self, token):
+        super().__init__()
+
+        self._token = token
+
+    def __str__(self) -> str:
+        return "Invalid seek continuation token: {}".format(self._token)
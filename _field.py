@@ -8,7 +8,7 @@ from typing import Any, Union, List as Lst, Optional, Iterable, Type, Tuple
 from inspect import isclass
 from datetime import datetime
 from decimal import Decimal as Dec
-from copy import deepcopy
+from copy import copy, deepcopy
 from bson.objectid import ObjectId as BSONObjectId
 from frozendict import frozendict
 from pytsite import lang, util, validation, formatters
@@ -18,6 +18,9 @@ class Base:
     """Base ODM Field
     """
 
+    __slots__ = ('_name', '_default', '_is_required', '_is_storable', '_is_modified', '_prev_value', '_value', '_uid',
+                 'entity')
+
     @property
     def is_storable(self) -> bool:
         """Get if the field is storable
@@ -60,6 +63,21 @@ class Base:
         """
         return self._name
 
+    @property
+    def uid(self) -> Optional[str]:
+        """Get unique ID of the field
+        """
+        if self._uid is None and self.entity is not None and not self.entity.is_new:
+            return '{}.{}.{}'.format(self.entity.model, self.entity.id, self._name)
+
+        return self._uid
+
+    @uid.setter
+    def uid(self, value: str):
+        """Set unique ID of the field
+        """
+        self._uid = value
+
     @property
     def default(self) -> Any:
         """Get default value of the field
@@ -98,15 +116,28 @@ class Base:
         self._is_modified = False
         self._prev_value = None
         self._value = None
+        self._uid = None
+        self.entity = None
 
         if self._default is not None:
             self.rst_val(update_state=False)
 
+    def clone(self):
+        """Get a copy of the field which value is independent from the original one
+        """
+        c = copy(self)
+        c._value = deepcopy(self._value)
+        c._prev_value = c._value if self._prev_value is self._value else deepcopy(self._prev_value)
+
+        return c
+
     def set_storable_val(self, value: Any):
         """Must be used to set value which can be safely stored directly to the database
         """
         self._value = value
 
+        return self
+
     def get_storable_val(self) -> Any:
         """Get value of the field which can be safely saved in the storage
         """
@@ -240,6 +271,8 @@ class Virtual(Base):
     """Virtual Field
     """
 
+    __slots__ = ()
+
     def __init__(self, name: str, **kwargs):
         super().__init__(name, is_storable=False, **kwargs)
 
@@ -248,6 +281,8 @@ class ObjectId(Base):
     """ObjectID Field
     """
 
+    __slots__ = ()
+
     def _on_set(self, raw_value: Optional[BSONObjectId], **kwargs):
         """Hook
         """
@@ -261,9 +296,12 @@ class Ref(Base):
     """Reference
     """
 
+    __slots__ = ('_model', '_model_cls', '_resolved')
+
     def __init__(self, name: str, **kwargs):
         """Init
         """
+        self._resolved = None  # Resolved entity and version of its model, see _on_get()
         self._model = kwargs.get('model', ())  # type: Tuple[str, ...]
         self._model_cls = kwargs.get('model_cls', ())  # type: Tuple[Type, ...]
 
@@ -316,18 +354,48 @@ class Ref(Base):
         if self._model_cls and entity.__class__ not in self._model_cls:
             raise TypeError('Instance of {} expected, not {}'.format(self._model_cls, type(entity)))
 
+        self.remember(entity)
+
         return entity.ref
 
+    def clone(self):
+        """Get a copy of the field which value is independent from the original one
+        """
+        c = super().clone()
+        c._resolved = None
+
+        return c
+
+    def remember(self, entity):
+        """Remember resolved entity, so it will be returned by get_val() without loading
+
+        :type entity: plugins.odm.Entity
+        """
+        from ._model import get_version
+        self._resolved = (entity, get_version(entity.model))
+
     def _on_get(self, value: Optional[str], **kwargs):
         """Hook
 
+        Resolved entity is reused until the reference changes or any entity of its model is saved or deleted.
+
         :rtype: Optional[Entity]
         """
         if value is None:
             return None
 
+        from ._model import get_version
+
+        if self._resolved:
+            entity, version = self._resolved
+            if entity.ref == value and not entity.is_deleted and version == get_version(entity.model):
+                return entity
+
         from ._api import get_by_ref
-        return get_by_ref(value)
+        entity = get_by_ref(value)
+        self.remember(entity)
+
+        return entity
 
     def _on_get_jsonable(self, value, **kwargs):
         """Get serializable representation of the field's value
@@ -360,6 +428,8 @@ class Bool(Base):
     """Integer Field
     """
 
+    __slots__ = ()
+
     def __init__(self, name: str, **kwargs):
         """Init.
         """
@@ -382,6 +452,8 @@ class Integer(Base):
     """Integer Field
     """
 
+    __slots__ = ('_minimum', '_maximum')
+
     @property
     def minimum(self) -> Optional[int]:
         return self._minimum
@@ -459,6 +531,8 @@ class Decimal(Base):
     """Decimal Field
     """
 
+    __slots__ = ('_minimum', '_maximum', '_precision', '_round')
+
     @property
     def minimum(self) -> Optional[int]:
         return self._minimum
@@ -577,6 +651,8 @@ class String(Base):
     """String Field
     """
 
+    __slots__ = ('_min_length', '_max_length', '_strip_html', '_tidyfy_html', '_remove_empty_html_tags')
+
     def __init__(self, name: str, **kwargs):
         """Init
         """
@@ -689,6 +765,8 @@ class DateTime(Base):
     """Datetime Field
     """
 
+    __slots__ = ()
+
     def _on_set(self, raw_value: Optional[datetime], **kwargs) -> Optional[datetime]:
         """Set field's value
         """
@@ -727,6 +805,8 @@ class List(Base):
     """List Field
     """
 
+    __slots__ = ('_allowed_types', '_min_len', '_max_len', '_is_unique', '_cleanup')
+
     def __init__(self, name: str, **kwargs):
         """Init
         """
@@ -839,6 +919,8 @@ class Dict(Base):
     """Dictionary Field
     """
 
+    __slots__ = ('_keys', '_nonempty_keys', '_dotted_keys', '_dotted_keys_replacement')
+
     def __init__(self, name: str, **kwargs):
         """Init
 
@@ -913,6 +995,8 @@ class Enum(Base):
     """Enumerated field
     """
 
+    __slots__ = ('_values',)
+
     def __init__(self, name: str, **kwargs):
         """Init
         """
@@ -938,6 +1022,8 @@ class UniqueList(List):
     """Unique List Field
     """
 
+    __slots__ = ()
+
     def __init__(self, name: str, **kwargs):
         """Init.
         """
@@ -948,11 +1034,14 @@ class RefsList(List):
     """List of References Field
     """
 
+    __slots__ = ('_model', '_model_cls', '_resolved')
+
     def __init__(self, name: str, **kwargs):
         """Init.
         """
         from ._model import Entity
 
+        self._resolved = {}  # Resolved entities and versions of their models by references, see _on_get()
         self._model = kwargs.get('model', ())  # type: Tuple[str, ...]
         self._model_cls = kwargs.get('model_cls', ())  # type: Tuple[Type, ...]
 
@@ -990,14 +1079,12 @@ class RefsList(List):
             raise TypeError(
                 "List or tuple expected as a value of the field '{}', not '{}'".format(self._name, repr(raw_value)))
 
-        from ._api import get_by_ref
+        from ._api import get_by_refs
 
         # Check value
         r = []
-        for v in raw_value:
-            # Check entity existence
-            entity = get_by_ref(v)
-
+        entities = get_by_refs(raw_value)
+        for entity in entities:
             # Check entity's model
             if self._model and entity.model not in self._model:
                 raise TypeError("Entity of model '{}' expected, not '{}'".format(self._model, entity.model))
@@ -1009,24 +1096,66 @@ class RefsList(List):
             if not self._is_unique or (self._is_unique and entity.ref not in r):
                 r.append(entity.ref)
 
+        self._resolved = {}
+        self.remember(entities)
+
         return r
 
+    def clone(self):
+        """Get a copy of the field which value is independent from the original one
+        """
+        c = super().clone()
+        c._resolved = {}
+
+        return c
+
+    def remember(self, entities):
+        """Remember resolved entities, so they will be returned by get_val() without loading
+
+        :type entities: Iterable[plugins.odm.Entity]
+        """
+        from ._model import get_version
+
+        for entity in entities:
+            self._resolved[entity.ref] = (entity, get_version(entity.model))
+
+    def _resolve(self, refs: Lst[str]) -> list:
+        """Get entities by references
+
+        Resolved entities are reused until any entity of their model is saved or deleted, others are loaded in bulk.
+        """
+        from ._api import get_by_refs
+        from ._model import get_version
+
+        r = {}
+        for ref in refs:
+            if ref in self._resolved:
+                entity, version = self._resolved[ref]
+                if not entity.is_deleted and version == get_version(entity.model):
+                    r[ref] = entity
+
+        missed = [ref for ref in refs if ref not in r]
+        if missed:
+            entities = get_by_refs(missed)
+            r.update(zip(missed, entities))
+            self.remember(entities)
+
+        return [r[ref] for ref in refs]
+
     def _on_get(self, value: Lst[str], **kwargs):
         """Get value of the field
 
         :rtype: List[odm.model.Entity, ...]
         """
-        from ._api import get_by_ref
+        sort_by = kwargs.get('sort_by')
+        limit = kwargs.get('limit')
 
-        r = []
-        for ref in value:
-            r.append(get_by_ref(ref))
+        # If there is no sorting, there is no need to load entities beyond the limit
+        r = self._resolve(value if sort_by or limit is None else value[:limit])
 
-        sort_by = kwargs.get('sort_by')
         if sort_by:
             r = sorted(r, key=lambda e: e.f_get(sort_by), reverse=kwargs.get('sort_reverse', False))
 
-        limit = kwargs.get('limit')
         if limit is not None:
             r = r[:limit]
 
@@ -1075,6 +1204,8 @@ class RefsUniqueList(RefsList):
     """Unique list of manual references field
     """
 
+    __slots__ = ()
+
     def __init__(self, name: str, **kwargs):
         """Init
         """
@@ -1085,6 +1216,8 @@ class IntegerList(List):
     """List of Integers Field
     """
 
+    __slots__ = ()
+
     def __init__(self, name: str, **kwargs):
         """Init.
         """
@@ -1095,6 +1228,8 @@ class UniqueIntegerList(UniqueList):
     """Unique String List Field
     """
 
+    __slots__ = ()
+
     def __init__(self, name: str, **kwargs):
         """Init.
         """
@@ -1105,6 +1240,8 @@ class DecimalList(List):
     """List of Decimals Field
     """
 
+    __slots__ = ()
+
     def __init__(self, name: str, **kwargs):
         """Init.
         """
@@ -1130,6 +1267,8 @@ class StringList(List):
     """List of Strings Field
     """
 
+    __slots__ = ()
+
     def __init__(self, name: str, **kwargs):
         """Init.
         """
@@ -1140,6 +1279,8 @@ class UniqueStringList(UniqueList):
     """Unique String List Field
     """
 
+    __slots__ = ()
+
     def __init__(self, name: str, **kwargs):
         """Init.
         """
@@ -1150,6 +1291,8 @@ class ListList(List):
     """List of Lists Field
     """
 
+    __slots__ = ()
+
     def __init__(self, name: str, **kwargs):
         """Init.
         """
@@ -1160,6 +1303,8 @@ class Email(String):
     """Email String Field
     """
 
+    __slots__ = ()
+
     def _on_set(self, raw_value: str, **kwargs) -> str:
         v_msg_id = 'odm@validation_field_email'
         v_msg_args = {'field': self.name}
@@ -4,20 +4,67 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from typing import List, Tuple, Union, Callable, Optional
+from typing import List, Tuple, Union, Callable, Optional, Iterator, Dict
 from abc import ABC, abstractmethod
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from collections import deque
+from itertools import islice
 from copy import deepcopy
-from bson import DBRef
+from functools import partial
+from heapq import heappush, heappop
+from concurrent.futures import Executor, ThreadPoolExecutor
+from threading import Lock
+from bson import DBRef, json_util
 from pymongo.cursor import Cursor, CursorType
 from pytsite import util, reg, cache
 from plugins import query as qu
-from . import _model, _api, _odm_query, _error
+from . import _model, _api, _odm_query, _error, _field, _cache, _metrics
 
 _CACHE_TTL = reg.get('odm.cache_ttl', 86400)  # 24 hours
+_BATCH_SIZE = reg.get('odm.finder_batch_size', 100)
+_RAW_BATCH_SIZE = reg.get('odm.raw_batch_size', 1000)
+_MFIND_CONCURRENT = reg.get('odm.mfind_concurrent', False)
+_MFIND_POOL_SIZE = reg.get('odm.mfind_pool_size', 4)
+
+_executor = None  # type: Optional[ThreadPoolExecutor]
+_executor_lock = Lock()
 
 _ResultProcessor = Callable[[_model.Entity], _model.Entity]
 
 
+def _get_executor() -> ThreadPoolExecutor:
+    """Get thread pool executor shared by all multi model finders
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(_MFIND_POOL_SIZE, 'odm.mfind')
+
+    return _executor
+
+
+def _encode_seek_token(values: list) -> str:
+    """Encode sort key values into an opaque continuation token
+    """
+    return urlsafe_b64encode(json_util.dumps(values).encode()).decode()
+
+
+def _decode_seek_token(token: str) -> list:
+    """Decode sort key values from a continuation token
+    """
+    try:
+        values = json_util.loads(urlsafe_b64decode(token.encode()).decode())
+    except (ValueError, TypeError):
+        raise _error.InvalidSeekToken(token)
+
+    # Tokens come from clients, so they must not contain anything which could be interpreted as a query operator
+    if not isinstance(values, list) or any(isinstance(v, (dict, list)) for v in values):
+        raise _error.InvalidSeekToken(token)
+
+    return values
+
+
 class Result(ABC):
     @abstractmethod
     def count(self) -> int:
@@ -36,16 +83,33 @@ class SingleModelResult(Result):
     """Finder Result
     """
 
-    def __init__(self, model: str, count: int, cursor: Cursor = None, cached_ids: List[str] = None,
+    def __init__(self, model: str, count: Optional[int], cursor: Cursor = None, cached_ids: List[str] = None,
                  process: _ResultProcessor = None, cache_ttl: int = None, cache_pool: cache.Pool = None,
-                 finder_id: str = None):
+                 finder_id: str = None, counter: Callable[[], int] = None, seek_fields: List[str] = None,
+                 projection: dict = None, prefetch: Tuple[str, ...] = (), cache_tokens: Dict[str, str] = None,
+                 cache_stale_ttl: int = 0, docs: List[dict] = None):
         """Init
+
+        If `count` is None, it will be calculated by `counter` only when requested. If `projection` is specified,
+        cursor's documents are considered as loaded using it. References of `prefetch` fields are resolved in bulk
+        for each chunk of entities. `cache_tokens` are tokens of finder's cache tags taken before the query has been
+        executed. `docs` are documents already read from the cursor.
         """
         self._model = model
+        self._cache_tokens = cache_tokens
+        self._cache_stale_ttl = cache_stale_ttl
+        self._prefetch = prefetch
+        self._projection = projection
+        self._seek_fields = seek_fields
+        self._last_entity = None
         self._count = count
+        self._counter = counter
         self._dispensed_cnt = 0
         self._cursor = cursor
+        self._docs = deque(docs or ())
         self._cached_ids = cached_ids
+        self._buffer = deque()
+        self._fetched_ids = []
         self._process = process
         self._cache_ttl = cache_ttl
         self._cache_pool = cache_pool
@@ -58,18 +122,36 @@ class SingleModelResult(Result):
     def __next__(self) -> _model.Entity:
         """Get next item
         """
-        if self._dispensed_cnt == self._count:
-            raise StopIteration()
-
-        # Get next document ID from cache or from database
-        doc_id = self._cached_ids[self._dispensed_cnt] if self._cached_ids else next(self._cursor)['_id']
+        # Dispense entity using an ID from cache or a document from database
+        if self._cached_ids is not None:
+            if self._dispensed_cnt == len(self._cached_ids):
+                raise StopIteration()
+
+            # Cached results are loaded by chunks
+            if not self._buffer:
+                ids = self._cached_ids[self._dispensed_cnt:self._dispensed_cnt + _BATCH_SIZE]
+                self._buffer.extend(self._prefetch_refs(_api.dispense_many(self._model, ids)))
+
+            entity = self._buffer.popleft()
+        elif self._prefetch:
+            # Entities are loaded by chunks to resolve their references in bulk
+            if not self._buffer:
+                self._buffer.extend(self._prefetch_refs(self._fetch_chunk()))
+                if not self._buffer:
+                    raise StopIteration()
+
+            entity = self._buffer.popleft()
+        else:
+            try:
+                doc = self._docs.popleft() if self._docs else next(self._cursor)
+            except StopIteration:
+                self._cache_fetched_ids()
+                raise
 
-        # Dispense entity
-        entity = _api.dispense(self._model, doc_id)
+            self._fetched_ids.append(doc['_id'])
+            entity = _api.dispense_from_data(self._model, doc, self._projection)
 
-        # Add document's ID to the cache
-        if not self._cached_ids and self._cache_ttl:
-            self._cache_pool.list_r_push(self._finder_id, doc_id)
+        self._last_entity = entity
 
         # Call response processor
         if self._process:
@@ -79,7 +161,85 @@ class SingleModelResult(Result):
 
         return entity
 
+    def _fetch_chunk(self) -> List[_model.Entity]:
+        """Dispense next chunk of entities from the cursor
+        """
+        docs = [self._docs.popleft() for _ in range(min(len(self._docs), _BATCH_SIZE))]
+        docs.extend(islice(self._cursor, _BATCH_SIZE - len(docs)))
+
+        r = []
+        for doc in docs:
+            self._fetched_ids.append(doc['_id'])
+            r.append(_api.dispense_from_data(self._model, doc, self._projection))
+
+        if len(r) < _BATCH_SIZE:
+            self._cache_fetched_ids()
+
+        return r
+
+    def preload(self):
+        """Fetch first batch of documents from the database
+
+        Only the database round trip is made, without dispensing entities, so it is safe to call it from another
+        thread. Results of cached finders are not preloaded.
+        """
+        if self._cached_ids is None and self._cursor is not None and not self._docs:
+            doc = next(self._cursor, None)
+            if doc is not None:
+                self._docs.append(doc)
+
+    def _prefetch_refs(self, entities: List[_model.Entity]) -> List[_model.Entity]:
+        """Resolve references of prefetched fields of entities in bulk
+        """
+        if not self._prefetch:
+            return entities
+
+        fields = [e.get_field(f_name) for e in entities for f_name in self._prefetch]
+
+        refs = set()
+        for f in fields:
+            if isinstance(f, _field.Ref):
+                if f.get_storable_val():
+                    refs.add(f.get_storable_val())
+            else:
+                refs.update(f.get_storable_val())
+
+        # Missing entities are not remembered, so they will raise an exception only on access to the field
+        resolved = {e.ref: e for e in _api.get_by_refs(refs, True)}
+
+        for f in fields:
+            if isinstance(f, _field.Ref):
+                if f.get_storable_val() in resolved:
+                    f.remember(resolved[f.get_storable_val()])
+            else:
+                f.remember([resolved[ref] for ref in f.get_storable_val() if ref in resolved])
+
+        return entities
+
+    @property
+    def next_token(self) -> Optional[str]:
+        """Get continuation token which can be passed to SingleModelFinder.seek() to get the next page
+        """
+        if not (self._seek_fields and self._last_entity):
+            return None
+
+        return _encode_seek_token([self._last_entity.get_field(f).get_storable_val() for f in self._seek_fields])
+
+    def _cache_fetched_ids(self):
+        """Put IDs of all fetched documents into the finder cache
+
+        It is called only when the cursor is exhausted, so partially iterated results never get into the cache.
+        """
+        if self._cache_ttl and self._fetched_ids is not None:
+            _cache.put_entry(self._cache_pool, self._finder_id, {'ids': self._fetched_ids}, self._cache_tokens,
+                             self._cache_ttl, self._cache_stale_ttl)
+
+        self._fetched_ids = None
+
     def count(self) -> int:
+        if self._count is None:
+            self._count = self._counter() if self._counter else 0
+
         return self._count
 
     def explain(self) -> dict:
@@ -106,14 +266,128 @@ class SingleModelResult(Result):
         return self.explain()['executionStats']
 
 
+class _SortKey:
+    """Sort key of an entity, compatible with MongoDB's sort order
+    """
+
+    __slots__ = ('_values', '_directions')
+
+    def __init__(self, entity: _model.Entity, sort: List[Tuple[str, int]]):
+        self._values = [entity.get_field(f).get_storable_val() if entity.has_field(f) else None for f, _ in sort]
+        self._directions = [d for _, d in sort]
+
+    @staticmethod
+    def _lt(a, b) -> bool:
+        # Missing values go first, values of incomparable types are ordered by types names
+        if a is None:
+            return b is not None
+        if b is None:
+            return False
+
+        try:
+            return a < b
+        except TypeError:
+            return type(a).__name__ < type(b).__name__
+
+    def __eq__(self, other) -> bool:
+        return self._values == other._values
+
+    def __lt__(self, other) -> bool:
+        for a, b, direction in zip(self._values, other._values, self._directions):
+            if a == b:
+                continue
+
+            return self._lt(a, b) if direction == _model.I_ASC else self._lt(b, a)
+
+        return False
+
+
 class MultiModelResult(Result):
-    def __init__(self, results: List[SingleModelResult], limit: int = 0):
+    def __init__(self, results: List[SingleModelResult], limit: int = 0, skip: int = 0,
+                 sort: List[Tuple[str, int]] = None, executor: Executor = None):
+        """Init
+
+        If `sort` is specified, results are merged according to it, otherwise they are taken one by one in turn.
+        `skip` and `limit` are applied to merged result. If `executor` is specified, first entities of all results
+        are preloaded concurrently.
+        """
         self._results = results
-        self._results_count = len(results)
-        self._current_result_index = 0
-        self._exhausted_results_indexes = []
-        self._dispensed_count = 0
         self._limit = limit
+        self._skip = skip
+        self._to_skip = skip
+        self._sort = sort
+        self._executor = executor
+        self._dispensed_count = 0
+        self._heads = None
+        self._heap = None
+        self._seq = 0
+        self._active = deque(range(len(results)))
+
+    def _fetch_heads(self):
+        """Fetch first entity of every result
+        """
+        # Only database round trips are made concurrently, entities are dispensed in current thread, so they get
+        # into the current session and are processed in the context of the current request
+        if self._executor:
+            list(self._executor.map(lambda r: r.preload(), self._results))
+
+        self._heads = dict(enumerate(next(r, None) for r in self._results))
+
+    def _pull(self, index: int) -> Optional[_model.Entity]:
+        """Get next entity of a result, None if the result is exhausted
+        """
+        if self._heads is None:
+            self._fetch_heads()
+
+        if index in self._heads:
+            return self._heads.pop(index)
+
+        return next(self._results[index], None)
+
+    def _push(self, index: int):
+        """Push next entity of a result to the heap
+        """
+        entity = self._pull(index)
+        if entity is None:
+            return
+
+        # Sequence number keeps order of entities with equal sort keys stable
+        heappush(self._heap, (_SortKey(entity, self._sort), self._seq, entity, index))
+        self._seq += 1
+
+    def _next_sorted(self) -> _model.Entity:
+        """Get next entity according to sort criteria
+        """
+        if self._heap is None:
+            self._heap = []
+            for i in range(len(self._results)):
+                self._push(i)
+
+        if not self._heap:
+            raise StopIteration()
+
+        _, _, entity, index = heappop(self._heap)
+        self._push(index)
+
+        return entity
+
+    def _next_round_robin(self) -> _model.Entity:
+        """Get next entity from results in turn
+        """
+        while self._active:
+            index = self._active.popleft()
+            entity = self._pull(index)
+            if entity is None:
+                continue
+
+            self._active.append(index)
+
+            return entity
+
+        raise StopIteration()
+
+    def _next(self) -> _model.Entity:
+        return self._next_sorted() if self._sort else self._next_round_robin()
 
     def __next__(self) -> _model.Entity:
         """Get next item
@@ -121,25 +395,17 @@ class MultiModelResult(Result):
         if self._limit and self._dispensed_count >= self._limit:
             raise StopIteration()
 
-        if len(self._exhausted_results_indexes) == self._results_count:
-            raise StopIteration()
+        while self._to_skip:
+            self._next()
+            self._to_skip -= 1
 
-        if self._current_result_index >= self._results_count:
-            self._current_result_index = 0
-
-        try:
-            e = next(self._results[self._current_result_index])
-            self._dispensed_count += 1
-        except StopIteration:
-            # Mark current result as exhausted and move forward
-            self._exhausted_results_indexes.append(self._current_result_index)
-            self._current_result_index += 1
-            e = next(self)
+        e = self._next()
+        self._dispensed_count += 1
 
         return e
 
     def count(self) -> int:
-        return sum([len(r) for r in self._results])
+        return max(sum([len(r) for r in self._results]) - self._skip, 0)
 
 
 class Finder(ABC):
@@ -153,21 +419,60 @@ class Finder(ABC):
         self._result_processor = None
         self._cache_ttl = _CACHE_TTL
         self._no_cache_fields = []
+        self._id = None
+        self._compiled_query = None
 
     @property
     def query(self) -> qu.Query:
+        """Get finder's query
+
+        If the query is modified directly rather than via finder's methods, reset() must be called afterwards.
+        """
         return self._query
 
     @property
     def id(self) -> str:
         """Get unique finder's ID to use as a cache key, etc
         """
-        q = deepcopy(self._query)
-        for f in self._no_cache_fields:
-            q.rm_field(f)
+        if self._id is None:
+            self._id = self._build_id()
+
+        return self._id
+
+    def _build_id(self) -> str:
+        """Build unique finder's ID
+        """
+        q = self._query
+        if self._no_cache_fields:
+            q = deepcopy(q)
+            for f in self._no_cache_fields:
+                q.rm_field(f)
 
         return util.md5_hex_digest('{}{}{}{}'.format(q, self._skip, self._limit, self._sort))
 
+    def _build_query(self) -> dict:
+        """Build the query
+        """
+        return self._query.compile()
+
+    def _compile_query(self) -> dict:
+        """Compile the query
+        """
+        if self._compiled_query is None:
+            self._compiled_query = self._build_query()
+
+        return self._compiled_query
+
+    def reset(self):
+        """Reset memoized finder's ID and compiled query
+
+        Must be called after every change of the finder's state.
+        """
+        self._id = None
+        self._compiled_query = None
+
+        return self
+
     @property
     def result_processor(self) -> Optional[Callable[[_model.Entity], _model.Entity]]:
         return self._result_processor
@@ -192,13 +497,14 @@ class Finder(ABC):
         """Set query's cache TTL
         """
         self._cache_ttl = value
+        self.reset()
 
     def cache(self, ttl: int):
         """Set query's cache TTL
         """
         self._cache_ttl = ttl
 
-        return self
+        return self.reset()
 
     def no_cache(self, field: str = None):
         """Disable caching of the field or entire query
@@ -208,21 +514,21 @@ class Finder(ABC):
         else:
             self.cache(0)
 
-        return self
+        return self.reset()
 
     def add(self, op: qu.Operator):
         """Add a query operator
         """
         self._query.add(op)
 
-        return self
+        return self.reset()
 
     def rm(self, field: str):
         """Remove all operator that use specified field
         """
         self._query.rm_field(field)
 
-        return self
+        return self.reset()
 
     def eq(self, field: str, arg):
         """Shortcut
@@ -331,14 +637,14 @@ class Finder(ABC):
         """
         self._skip = num
 
-        return self
+        return self.reset()
 
     def sort(self, fields: List[Tuple[str, int]] = None):
         """Set sort criteria
         """
         self._sort = fields
 
-        return self
+        return self.reset()
 
     def add_sort(self, field: str, direction: int = _model.I_ASC, pos: int = None):
         """Add a sort criteria
@@ -351,7 +657,7 @@ class Finder(ABC):
 
         self._sort.insert(pos, (field, direction))
 
-        return self
+        return self.reset()
 
     @abstractmethod
     def count(self) -> int:
@@ -365,6 +671,25 @@ class Finder(ABC):
         """
         raise NotImplementedError()
 
+    @abstractmethod
+    def iter_raw(self, batch_size: int = None, decode: bool = False) -> Iterator[dict]:
+        """Iterate over raw documents
+        """
+        raise NotImplementedError()
+
+    def iter_batches(self, n: int, decode: bool = False) -> Iterator[List[dict]]:
+        """Iterate over lists of raw documents of size `n`
+        """
+        batch = []
+        for doc in self.iter_raw(n, decode):
+            batch.append(doc)
+            if len(batch) == n:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
     def first(self) -> Union[_model.Entity, None]:
         """Get first result
         """
@@ -392,7 +717,7 @@ class Finder(ABC):
         return self.get()
 
     def __str__(self) -> str:
-        return str(self._query.compile())
+        return str(self._compile_query())
 
 
 class SingleModelFinder(Finder):
@@ -406,10 +731,24 @@ class SingleModelFinder(Finder):
             raise _error.ModelNotRegistered(model)
 
         self._model = model
-        self._mock = _api.dispense(model)
+        self._schema = _api.get_schema(model)
+        self._mock = None
         self._cache_pool = cache.get_pool('odm.finder.' + model)
+        self._is_seek = False
+        self._seek_after = None
+        self._projection = None
+        self._prefetch = ()
+        self._stale_ttl = 0
 
-        super().__init__(_odm_query.ODMQuery(self._mock, query))
+        super().__init__(_odm_query.ODMQuery(self._schema, query))
+
+    def _build_id(self) -> str:
+        """Build unique finder's ID
+        """
+        if not self._is_seek:
+            return super()._build_id()
+
+        return util.md5_hex_digest('{}{}'.format(super()._build_id(), json_util.dumps(self._seek_after)))
 
     @property
     def model(self) -> str:
@@ -421,12 +760,21 @@ class SingleModelFinder(Finder):
     def mock(self) -> _model.Entity:
         """Get finder mock entity
         """
+        if self._mock is None:
+            self._mock = _api.dispense(self._model)
+
         return self._mock
 
+    @property
+    def schema(self) -> _model.Schema:
+        """Get finder model's schema
+        """
+        return self._schema
+
     def rm(self, field: str):
         """Remove all operator that use specified field
         """
-        if not self._mock.has_field(field):
+        if not self._schema.has_field(field):
             raise _error.FieldNotDefined(self._model, field)
 
         return super().rm(field)
@@ -435,7 +783,7 @@ class SingleModelFinder(Finder):
         """Get a list of distinct values for field among all documents in the collection
         """
         from ._api import get_by_ref
-        values = self._mock.collection.distinct(field, self._query.compile())
+        values = self._schema.collection.distinct(field, self._compile_query())
 
         r = []
         for v in values:
@@ -451,7 +799,7 @@ class SingleModelFinder(Finder):
         """
         if fields:
             for f in fields:
-                if not self._mock.has_field(f[0]):
+                if not self._schema.has_field(f[0]):
                     raise _error.FieldNotDefined(self._model, f[0])
             self._sort = fields
 
@@ -460,51 +808,328 @@ class SingleModelFinder(Finder):
     def add_sort(self, field: str, direction: int = _model.I_ASC, pos: int = None):
         """Add a sort criteria
         """
-        if not self._mock.has_field(field):
+        if not self._schema.has_field(field):
             raise _error.FieldNotDefined(self._model, field)
 
         return super().add_sort(field, direction, pos)
 
-    def count(self) -> int:
-        """Count documents in collection
+    def _get_seek_sort(self) -> List[Tuple[str, int]]:
+        """Get sort criteria used in seek mode
+
+        Sort always ends with the '_id' field to make order of documents with equal sort keys stable.
         """
-        ckey = self.id + '_count'
+        sort = list(self._sort) if self._sort else []
 
-        if self._cache_ttl and self._cache_pool.has(ckey):
-            return self._cache_pool.get(ckey)
+        if '_id' not in [f[0] for f in sort]:
+            sort.append(('_id', sort[-1][1] if sort else _model.I_ASC))
 
-        cnt = self._mock.collection.count_documents(self._query.compile(), skip=self._skip)
+        return sort
 
-        if self._cache_ttl:
-            self._cache_pool.put(ckey, cnt, self._cache_ttl)
+    def _build_query(self) -> dict:
+        """Build the query including seek range predicate, if any
+        """
+        query = super()._build_query()
 
-        return cnt
+        if not (self._is_seek and self._seek_after):
+            return query
 
-    def get(self, limit: int = 0) -> SingleModelResult:
-        """Execute the query
+        sort = self._get_seek_sort()
+        if len(self._seek_after) != len(sort):
+            raise _error.InvalidSeekToken(self._seek_after)
+
+        # (f1 > v1) OR (f1 == v1 AND f2 > v2) OR ...
+        predicates = []
+        for i, (f_name, direction) in enumerate(sort):
+            predicate = {sort[j][0]: {'$eq': self._seek_after[j]} for j in range(i)}
+            value = self._seek_after[i]
+
+            # MongoDB sorts nulls before any other values, but never matches them by range operators
+            if value is None:
+                if direction == _model.I_DESC:
+                    continue
+                predicate[f_name] = {'$ne': None}
+            elif direction == _model.I_ASC:
+                predicate[f_name] = {'$gt': value}
+            elif f_name == '_id':
+                predicate[f_name] = {'$lt': value}
+            else:
+                predicate['$or'] = [{f_name: {'$lt': value}}, {f_name: None}]
+
+            predicates.append(predicate)
+
+        seek_query = {'$or': predicates} if len(predicates) > 1 else predicates[0]
+
+        return {'$and': [query, seek_query]} if query else seek_query
+
+    def seek(self, after: Union[str, list, tuple, None] = None):
+        """Switch the finder to keyset pagination mode
+
+        `after` is a continuation token got from SingleModelResult.next_token, or a sequence of sort key values of the
+        last seen entity, including the trailing `_id`. Call this method without arguments to get the first page.
+
+        Null values of sort fields are supported, but each sort field must not contain values of different types
+        otherwise, because MongoDB range operators never match values of other types.
         """
-        self._limit = limit
+        if isinstance(after, str):
+            after = _decode_seek_token(after)
 
-        query = self._query.compile()
+        self._is_seek = True
+        self._seek_after = list(after) if after else None
 
-        # Try to load result from cache
-        if self._cache_ttl and self._cache_pool.has(self.id):
-            cached_ids = self._cache_pool.get_list(self.id)
-            count = len(cached_ids) if cached_ids else 0
-            return SingleModelResult(self._model, count, None, cached_ids, self._result_processor)
+        return self.reset()
 
-        cursor = self._mock.collection.find(
-            filter=query,
+    def iter_raw(self, batch_size: int = None, decode: bool = False) -> Iterator[dict]:
+        """Iterate over raw documents
+
+        Documents are streamed directly from the cursor, bypassing entities and finder caches. If `decode` is True,
+        values of documents' fields are transformed to the same form as returned by Entity.f_get(), except values of
+        reference fields, which are kept as references' strings to not load referenced entities.
+        """
+        cursor = self._schema.collection.find(
+            filter=self._compile_query(),
+            projection=self._projection,
             skip=self._skip,
-            limit=self._limit,
             cursor_type=CursorType.NON_TAILABLE,
-            sort=self._sort,
+            sort=self._get_seek_sort() if self._is_seek else self._sort,
+            batch_size=batch_size or _RAW_BATCH_SIZE,
         )
 
-        # Result
-        count = self._mock.collection.count_documents(query, skip=self._skip)
-        return SingleModelResult(self._model, count, cursor, None, self._result_processor, self._cache_ttl,
-                                 self._cache_pool, self.id)
+        if not decode:
+            yield from cursor
+            return
+
+        # Fields used to decode values
+        fields = {f_name: f.clone() for f_name, f in self._schema.fields.items()
+                  if f.is_storable and not isinstance(f, (_field.Ref, _field.RefsList))}
+
+        for doc in cursor:
+            for f_name, f_value in doc.items():
+                if f_name in fields:
+                    doc[f_name] = fields[f_name].set_storable_val(f_value).get_val()
+
+            yield doc
+
+    def only(self, *fields: str):
+        """Load only specified fields of entities
+
+        Other fields are loaded on first access. Partially loaded documents are never put into the entities cache.
+        """
+        for f_name in fields:
+            if not self._schema.has_field(f_name):
+                raise _error.FieldNotDefined(self._model, f_name)
+
+        self._projection = {f_name: True for f_name in fields + ('_id', '_ref', '_model')}
+
+        return self.reset()
+
+    def exclude(self, *fields: str):
+        """Don't load specified fields of entities
+
+        Excluded fields are loaded on first access. Partially loaded documents are never put into the entities cache.
+        """
+        for f_name in fields:
+            if not self._schema.has_field(f_name):
+                raise _error.FieldNotDefined(self._model, f_name)
+            if f_name in ('_id', '_ref', '_model'):
+                raise ValueError("Field '{}' cannot be excluded".format(f_name))
+
+        self._projection = {f_name: False for f_name in fields}
+
+        return self.reset()
+
+    def _get_cache_tags(self) -> List[str]:
+        """Get tags of the finder's cache entries
+
+        Entry depends on each field referred by the query or the sort. If the query requires a field to be equal to a
+        scalar value, entry is affected only by inserted or deleted entities having the same value of the field.
+        """
+        query = self._compile_query()
+        sort = self._get_seek_sort() if self._is_seek else self._sort or []
+        fields = set(f_name for f_name, _ in sort)
+        tags = set()
+
+        def collect_fields(q: dict):
+            for k, v in q.items():
+                if k in ('$and', '$or', '$nor'):
+                    for sub_q in v:
+                        collect_fields(sub_q)
+                elif k.startswith('$'):
+                    # Dependencies of operators like '$text' or '$where' are unknown
+                    tags.add('*')
+                else:
+                    fields.add(k)
+
+        def find_eq(q: dict) -> Optional[str]:
+            for k, v in q.items():
+                if k == '$and':
+                    for sub_q in v:
+                        tag = find_eq(sub_q)
+                        if tag:
+                            return tag
+                elif not k.startswith('$') and self._schema.has_field(k) \
+                        and not isinstance(self._schema.get_field(k), (_field.List, _field.Dict)):
+                    if isinstance(v, dict) and list(v.keys()) == ['$eq']:
+                        v = v['$eq']
+                    if _cache.is_eq_tag_value(v):
+                        return _cache.eq_tag(k, v)
+
+        collect_fields(query)
+        tags.update(_cache.field_tag(f_name) for f_name in fields)
+        tags.add(find_eq(query) or '$any')
+
+        return sorted(tags)
+
+    def stale_while_revalidate(self, ttl: int = 60):
+        """Serve expired or invalidated cached results while other worker rebuilds them
+
+        Cached results are served as stale during `ttl` seconds after expiration, 0 disables stale results.
+        """
+        self._stale_ttl = ttl
+
+        return self
+
+    def _get_cache_entry(self, key: str, metric: str, generation: str,
+                         single_flight: bool = True) -> Tuple[Optional[dict], bool]:
+        """Get cached entry using single-flight
+
+        Returns the entry and a flag showing that current worker acquired the lock and must build the entry. If other
+        worker is building the entry, stale entry is returned if allowed, otherwise the worker is waited for. If
+        `single_flight` is False, the entry is neither locked nor waited for.
+        """
+        entry = _cache.get_entry(self._cache_pool, key)
+        if _cache.is_entry_valid(self._model, entry, generation):
+            _metrics.incr(metric + '.hit', self._model, finder=self.id)
+            return entry, False
+
+        _metrics.incr(metric + '.miss', self._model, finder=self.id)
+
+        if not single_flight:
+            return None, False
+
+        if _cache.acquire_lock(self._cache_pool, key):
+            return None, True
+
+        if entry and self._stale_ttl:
+            _metrics.incr(metric + '.stale', self._model, finder=self.id)
+            return entry, False
+
+        # Entry being built by current process is not waited for, it is faster to query the database
+        if _cache.is_lock_held(key):
+            return None, False
+
+        with _metrics.timer(metric + '.wait_time', self._model, self.id):
+            entry = _cache.wait_entry(self._cache_pool, self._model, key, generation)
+
+        return entry, False
+
+    def prefetch(self, *fields: str):
+        """Resolve references of specified fields in bulk
+
+        Referenced entities are loaded for each chunk of result using single query per model, so access to the fields
+        of result's entities doesn't cause further loads.
+        """
+        for f_name in fields:
+            if not isinstance(self._schema.get_field(f_name), (_field.Ref, _field.RefsList)):
+                raise TypeError("Field '{}' of model '{}' is not a reference".format(f_name, self._model))
+
+        self._prefetch = fields
+
+        return self
+
+    def _get_projection(self) -> Optional[dict]:
+        """Get projection which includes prefetched fields
+        """
+        if not (self._projection and self._prefetch):
+            return self._projection
+
+        projection = dict(self._projection)
+        if next(iter(projection.values())):
+            projection.update({f_name: True for f_name in self._prefetch})
+        else:
+            for f_name in self._prefetch:
+                projection.pop(f_name, None)
+
+        return projection or None
+
+    def count(self) -> int:
+        """Count documents in collection
+        """
+        if not self._cache_ttl:
+            return self._schema.collection.count_documents(self._compile_query(), skip=self._skip)
+
+        generation = _cache.get_generation(self._model)
+        ckey = _cache.finder_key(self._model, self.id + '_count', generation)
+        entry, locked = self._get_cache_entry(ckey, 'finder.count', generation)
+        if entry:
+            return entry['count']
+
+        try:
+            tokens = _cache.get_tags_tokens(self._model, self._get_cache_tags(), self._cache_ttl, generation)
+            _metrics.incr('finder.count.db_query', self._model, finder=self.id)
+            with _metrics.timer('finder.count.db_time', self._model, self.id):
+                cnt = self._schema.collection.count_documents(self._compile_query(), skip=self._skip)
+            _cache.put_entry(self._cache_pool, ckey, {'count': cnt}, tokens, self._cache_ttl, self._stale_ttl)
+        finally:
+            if locked:
+                _cache.release_lock(self._cache_pool, ckey)
+
+        return cnt
+
+    def get(self, limit: int = 0) -> SingleModelResult:
+        """Execute the query
+        """
+        if limit != self._limit:
+            self._limit = limit
+            self._id = None
+
+        query = self._compile_query()
+        sort = self._get_seek_sort() if self._is_seek else self._sort
+        seek_fields = [f[0] for f in sort] if self._is_seek else None
+
+        # Try to load result from cache
+        ckey = None
+        tokens = None
+        locked = False
+        if self._cache_ttl:
+            generation = _cache.get_generation(self._model)
+            ckey = _cache.finder_key(self._model, self.id, generation)
+
+            # Unlimited results are not built by a single worker, because they are read lazily
+            entry, locked = self._get_cache_entry(ckey, 'finder', generation, bool(self._limit))
+            if entry:
+                return SingleModelResult(self._model, len(entry['ids']), None, entry['ids'], self._result_processor,
+                                         seek_fields=seek_fields, prefetch=self._prefetch)
+
+        projection = self._get_projection()
+        docs = None
+        _metrics.incr('finder.db_query', self._model, finder=self.id)
+        try:
+            if self._cache_ttl:
+                tokens = _cache.get_tags_tokens(self._model, self._get_cache_tags(), self._cache_ttl, generation)
+
+            cursor = self._schema.collection.find(
+                filter=query,
+                projection=projection,
+                skip=self._skip,
+                limit=self._limit,
+                cursor_type=CursorType.NON_TAILABLE,
+                sort=sort,
+            )
+
+            # Lock must not depend on how the result will be iterated, so documents are read and cached at once
+            if locked:
+                docs = list(cursor)
+                _cache.put_entry(self._cache_pool, ckey, {'ids': [d['_id'] for d in docs]}, tokens, self._cache_ttl,
+                                 self._stale_ttl)
+        finally:
+            if locked:
+                _cache.release_lock(self._cache_pool, ckey)
+
+        # Result, documents will be counted only if requested
+        counter = partial(self._schema.collection.count_documents, query, skip=self._skip)
+        return SingleModelResult(self._model, None, cursor, None, self._result_processor,
+                                 None if locked else self._cache_ttl, self._cache_pool, ckey, counter, seek_fields,
+                                 projection, self._prefetch, tokens, self._stale_ttl, docs)
 
 
 class MultiModelFinder(Finder):
@@ -517,6 +1142,25 @@ class MultiModelFinder(Finder):
         super().__init__(query)
 
         self._finders = [SingleModelFinder(model, query) for model in models]
+        self._concurrent = _MFIND_CONCURRENT
+
+    def concurrent(self, enabled: bool = True):
+        """Enable or disable concurrent querying of models' collections
+
+        Queries are executed by a thread pool which size is set by the 'odm.mfind_pool_size' registry key. Only
+        queries to the database and the cache are made by the pool, entities are dispensed in the calling thread.
+        """
+        self._concurrent = enabled
+
+        return self
+
+    def _map(self, func: Callable, items: list) -> list:
+        """Apply function to every item, concurrently if it is enabled
+        """
+        if self._concurrent and len(items) > 1:
+            return list(_get_executor().map(func, items))
+
+        return [func(item) for item in items]
 
     def add(self, op: qu.Operator):
         """Add a query criteria
@@ -528,22 +1172,44 @@ class MultiModelFinder(Finder):
             except _error.FieldNotDefined:
                 pass
 
-        return self
+        return self.reset()
 
     def rm(self, field: str):
         """Remove all operator that use specified field
         """
         for f in self._finders:
-            f.rm(field)
+            if f.schema.has_field(field):
+                f.rm(field)
 
-        return self
+        return self.reset()
+
+    def iter_raw(self, batch_size: int = None, decode: bool = False) -> Iterator[dict]:
+        """Iterate over raw documents of all models, one model after another
+        """
+        for f in self._finders:
+            yield from f.iter_raw(batch_size, decode)
 
     def count(self):
         """Count entities
         """
-        return sum([f.count() for f in self._finders])
+        return max(sum(self._map(lambda f: f.skip(0).count(), self._finders)) - self._skip, 0)
 
     def get(self, limit: int = 0) -> MultiModelResult:
         """Get result
+
+        Each model's finder fetches at most `skip + limit` documents, because no more of them can get into the
+        merged result.
         """
-        return MultiModelResult([f.skip(self._skip).get(limit) for f in self._finders], limit)
+        batch_size = self._skip + limit if limit else 0
+
+        # Fields missing in a model are skipped, entities of such model are ordered by _SortKey as having null values
+        for f in self._finders:
+            f.skip(0)
+            if self._sort:
+                f.sort([s for s in self._sort if f.schema.has_field(s[0])] or None)
+
+        # Getting results doesn't dispense entities, so it is done concurrently, like preloading of their first batches
+        results = self._map(lambda f: f.get(batch_size), self._finders)
+        executor = _get_executor() if self._concurrent and len(results) > 1 else None
+
+        return MultiModelResult(results, limit, self._skip, self._sort, executor)
@@ -0,0 +1,241 @@
+"""PytSite ODM Plugin Cache Metrics
+"""
+__author__ = 'Oleksandr Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Dict, Tuple, Optional
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from os import getpid
+from socket import gethostname
+from threading import Lock
+from time import perf_counter, time
+from pytsite import reg, cache
+
+_MetricKey = Tuple[str, str, Optional[str]]  # Metric's name, model and finder's ID
+
+_collector = None  # type: Optional[Collector]
+
+# Number of finders is unbounded, so their metrics are recorded separately only on demand
+_FINDERS = reg.get('odm.metrics_finders', False)
+
+# Snapshots of collectors of all processes are stored in a cache pool to be aggregated by the console command
+_POOL = 'odm.metrics'
+_FLUSH_INTERVAL = reg.get('odm.metrics_flush_interval', 60)
+_SNAPSHOT_TTL = 86400
+_last_flush = 0.0
+_last_reset = 0.0
+
+
+class Collector(ABC):
+    """Metrics Collector
+    """
+
+    @abstractmethod
+    def incr(self, name: str, model: str, value: int = 1, finder: str = None):
+        """Increment a counter
+        """
+        pass
+
+    @abstractmethod
+    def observe(self, name: str, model: str, value: float, finder: str = None):
+        """Add a value to a histogram
+        """
+        pass
+
+
+class MemoryCollector(Collector):
+    """Collector which keeps metrics in memory of current process
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)):
+        """Init
+
+        `buckets` are upper bounds of histograms buckets.
+        """
+        self._buckets = tuple(sorted(buckets))
+        self._counters = {}  # type: Dict[_MetricKey, int]
+        self._histograms = {}  # type: Dict[_MetricKey, dict]
+        self._lock = Lock()
+
+    @property
+    def buckets(self) -> Tuple[float, ...]:
+        return self._buckets
+
+    def incr(self, name: str, model: str, value: int = 1, finder: str = None):
+        key = (name, model, finder)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, model: str, value: float, finder: str = None):
+        key = (name, model, finder)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = {'count': 0, 'sum': 0.0, 'buckets': [0] * (len(self._buckets) + 1)}
+
+            h = self._histograms[key]
+            h['count'] += 1
+            h['sum'] += value
+            h['buckets'][bisect_left(self._buckets, value)] += 1
+
+    def get_counters(self) -> Dict[_MetricKey, int]:
+        """Get counters
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    def get_histograms(self) -> Dict[_MetricKey, dict]:
+        """Get histograms
+
+        Each histogram contains number of values, their sum and numbers of values in each bucket. The last bucket
+        counts values greater than the largest bound.
+        """
+        with self._lock:
+            return {k: dict(v, buckets=list(v['buckets'])) for k, v in self._histograms.items()}
+
+    def reset(self):
+        """Reset all metrics
+        """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> dict:
+        """Get all metrics in a form which can be stored in a cache pool
+        """
+        with self._lock:
+            return {
+                'buckets': list(self._buckets),
+                'counters': [list(k) + [v] for k, v in self._counters.items()],
+                'histograms': [list(k) + [dict(v, buckets=list(v['buckets']))] for k, v in self._histograms.items()],
+            }
+
+    def merge(self, snapshot: dict):
+        """Add metrics of a snapshot
+
+        Histograms of a snapshot taken with other buckets are ignored.
+        """
+        with self._lock:
+            for name, model, finder, value in snapshot['counters']:
+                key = (name, model, finder)
+                self._counters[key] = self._counters.get(key, 0) + value
+
+            if tuple(snapshot['buckets']) != self._buckets:
+                return
+
+            for name, model, finder, h in snapshot['histograms']:
+                key = (name, model, finder)
+                if key not in self._histograms:
+                    self._histograms[key] = {'count': 0, 'sum': 0.0, 'buckets': [0] * (len(self._buckets) + 1)}
+
+                r = self._histograms[key]
+                r['count'] += h['count']
+                r['sum'] += h['sum']
+                r['buckets'] = [a + b for a, b in zip(r['buckets'], h['buckets'])]
+
+
+def set_collector(collector: Optional[Collector]):
+    """Set metrics collector, None disables metrics
+    """
+    global _collector
+
+    _collector = collector
+
+
+def get_collector() -> Optional[Collector]:
+    """Get metrics collector
+    """
+    return _collector
+
+
+def flush(force: bool = False):
+    """Store snapshot of current process's MemoryCollector in the cache pool
+
+    Snapshot is stored not more often than once per `odm.metrics_flush_interval` seconds, unless `force` is True.
+    """
+    global _last_flush, _last_reset
+
+    if not isinstance(_collector, MemoryCollector) or not force and time() - _last_flush < _FLUSH_INTERVAL:
+        return
+
+    _last_flush = time()
+    pool = cache.get_pool(_POOL)
+
+    # Metrics collected before a reset requested by other process are dropped
+    try:
+        reset_time = pool.get('reset')
+    except cache.error.KeyNotExist:
+        reset_time = 0.0
+
+    if reset_time > _last_reset:
+        _collector.reset()
+        _last_reset = reset_time
+
+    pool.put('snapshot.{}.{}'.format(gethostname(), getpid()), _collector.snapshot(), _SNAPSHOT_TTL)
+
+
+def aggregate() -> Optional[MemoryCollector]:
+    """Get metrics of all processes stored by flush(), None if there are no any
+    """
+    r = None
+    pool = cache.get_pool(_POOL)
+    for key in pool.keys():
+        if not key.startswith('snapshot.'):
+            continue
+
+        try:
+            snapshot = pool.get(key)
+        except cache.error.KeyNotExist:
+            continue
+
+        if r is None:
+            r = MemoryCollector(tuple(snapshot['buckets']))
+        r.merge(snapshot)
+
+    return r
+
+
+def reset_all():
+    """Reset metrics of all processes
+
+    Processes reset their collectors on the next flush().
+    """
+    pool = cache.get_pool(_POOL)
+    pool.clear()
+    pool.put('reset', time(), _SNAPSHOT_TTL)
+
+
+def incr(name: str, model: str, value: int = 1, finder: str = None):
+    """Increment a counter
+
+    `finder` is passed to the collector only if the `odm.metrics_finders` registry option is enabled.
+    """
+    if _collector is not None:
+        _collector.incr(name, model, value, finder if _FINDERS else None)
+
+
+def observe(name: str, model: str, value: float, finder: str = None):
+    """Add a value to a histogram
+
+    `finder` is passed to the collector only if the `odm.metrics_finders` registry option is enabled.
+    """
+    if _collector is not None:
+        _collector.observe(name, model, value, finder if _FINDERS else None)
+
+
+@contextmanager
+def timer(name: str, model: str, finder: str = None):
+    """Observe duration of a block in seconds
+    """
+    finder = finder if _FINDERS else None
+    if _collector is None:
+        yield
+        return
+
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        _collector.observe(name, model, perf_counter() - started, finder)
@@ -4,27 +4,139 @@ __author__ = 'Oleksandr Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from typing import Any, Dict, List, Tuple, Union, Generator
+from typing import Any, Dict, List, Tuple, Union, Generator, Optional, Set, Mapping
 from abc import ABC, abstractmethod
-from collections import OrderedDict
+from types import MappingProxyType
 from copy import deepcopy
 from datetime import datetime
 from pymongo import ASCENDING as I_ASC, DESCENDING as I_DESC, GEO2D as I_GEO2D, TEXT as I_TEXT, GEOSPHERE as I_GEOSPHERE
 from bson.objectid import ObjectId
 from pymongo.collection import Collection
 from pymongo.errors import OperationFailure
-from pytsite import mongodb, events, lang, errors, cache, reg
-from . import _error, _field, _queue
+from pytsite import mongodb, events, lang, errors, cache
+from . import _error, _field, _queue, _cache, _metrics
 
-_CACHE_POOL = cache.get_pool('odm.entities')
-_CACHE_TTL = reg.get('odm.cache_ttl', 86400)
+_SCHEMAS = {}  # type: Dict[str, Schema]
+_VERSIONS = {}  # type: Dict[str, int]
+
+
+class Schema:
+    """Fields and indexes definition of a model
+
+    It is built once per model by the first instantiated entity and then used as a prototype for other entities.
+    Also it is used as a read-only model's mock to look up fields, indexes and collection.
+    """
+
+    def __init__(self, entity):
+        """Init
+
+        :type entity: Entity
+        """
+        self._model = entity.model
+        self._cls = entity.__class__
+        self._collection_name = entity.collection_name
+        self._fields = {}
+        for f_name, f in entity.fields.items():
+            # Prototypes must not keep the entity they have been built from alive
+            self._fields[f_name] = f.clone()
+            self._fields[f_name].entity = None
+
+        self._indexes = list(entity.indexes)
+        self._has_text_index = entity.has_text_index
+
+    @property
+    def model(self) -> str:
+        """Get model name
+        """
+        return self._model
+
+    @property
+    def cls(self) -> type:
+        """Get model class
+        """
+        return self._cls
+
+    @property
+    def collection_name(self) -> str:
+        """Get name of model's DB collection
+        """
+        return self._collection_name
+
+    @property
+    def collection(self) -> Collection:
+        """Get model's DB collection
+        """
+        return mongodb.get_collection(self._collection_name)
+
+    @property
+    def fields(self) -> Mapping[str, _field.Base]:
+        """Get prototypes of model's fields
+        """
+        return MappingProxyType(self._fields)
+
+    def has_field(self, field_name: str) -> bool:
+        """Check if the model has a field
+        """
+        return field_name in self._fields
+
+    def get_field(self, field_name: str) -> _field.Base:
+        """Get field's prototype
+        """
+        if field_name not in self._fields:
+            raise _error.FieldNotDefined(self._model, field_name)
+
+        return self._fields[field_name]
+
+    @property
+    def indexes(self) -> list:
+        """Get index information
+        """
+        return self._indexes
+
+    @property
+    def has_text_index(self) -> bool:
+        """If model has text index
+        """
+        return self._has_text_index
+
+
+def get_version(model: str) -> int:
+    """Get number of changes of model's entities made by this process
+
+    It is used to invalidate in-process data which depends on entities, such as resolved references.
+    """
+    return _VERSIONS.get(model, 0)
+
+
+def bump_version(model: str):
+    """Increment number of changes of model's entities
+    """
+    _VERSIONS[model] = _VERSIONS.get(model, 0) + 1
+
+
+def reset_schema(model: str = None):
+    """Reset cached schema of a model or of all models
+    """
+    if model:
+        _SCHEMAS.pop(model, None)
+    else:
+        _SCHEMAS.clear()
 
 
 class Entity(ABC):
     """ODM Entity
     """
+
+    __slots__ = ('_model', '_is_new', '_is_modified', '_is_being_saved', '_is_being_deleted', '_is_deleted',
+                 '_indexes', '_has_text_index', '_pending_children', '_unloaded_fields', '_raw_data', '_fields',
+                 '__weakref__')
+
     _collection_name = None
     _history_fields = None  # type: List[str]
+    # Set to True to set up entities by cloning model's schema, if fields, their default values and indexes don't depend
+    # on a particular entity instance or on the moment it is created
+    _cache_schema = False
+    _lazy_fields_decoding = False  # Set to True to set loaded values of fields only on first access to them
     _deprecated_methods = {
         '_pre_save': '_on_pre_save',
         '_after_save': '_on_after_save',
@@ -47,16 +159,28 @@ class Entity(ABC):
         """
         return self._has_text_index
 
+    @property
+    def collection_name(self) -> str:
+        """Get name of entity's DB collection
+        """
+        return self._collection_name or lang.english_plural(self._model)
+
     @property
     def collection(self) -> Collection:
         """Get entity's DB collection
         """
-        return mongodb.get_collection(self._collection_name)
+        return mongodb.get_collection(self.collection_name)
 
     @property
     def fields(self) -> Dict[str, _field.Base]:
         """Get entity's fields
         """
+        if self._unloaded_fields:
+            self._load_unloaded_fields()
+
+        if self._raw_data:
+            self._decode_raw_data()
+
         return self._fields
 
     @property
@@ -287,10 +411,6 @@ class Entity(ABC):
     def __init__(self, model: str, obj_id: Union[str, ObjectId, None] = None):
         """Init
         """
-        # Define collection name if it wasn't specified
-        if not self._collection_name:
-            self._collection_name = lang.english_plural(model)
-
         self._model = model
         self._is_new = True
         self._is_modified = True
@@ -300,8 +420,44 @@ class Entity(ABC):
         self._indexes = []
         self._has_text_index = False
         self._pending_children = []
+        self._unloaded_fields = None  # type: Optional[Set[str]]
+        self._raw_data = None  # type: Optional[dict]
 
-        self._fields = OrderedDict()  # type: Dict[str, _field.Base]
+        self._fields = {}  # type: Dict[str, _field.Base]
+
+        schema = _SCHEMAS.get(model) if self._cache_schema else None
+        if schema and schema.cls is self.__class__:
+            self._setup_from_schema(schema)
+        else:
+            self._setup_schema()
+
+        # Load fields data from database or cache
+        if obj_id:
+            self._load_fields_data(ObjectId(obj_id) if isinstance(obj_id, str) else obj_id)
+
+    def _setup_from_schema(self, schema: Schema):
+        """Setup fields and indexes by cloning model's schema
+        """
+        for f_name, f in schema.fields.items():
+            self._fields[f_name] = f.clone()
+            self._fields[f_name].entity = self
+
+        # Default timestamps must not be inherited from the schema, other properties of the fields are kept
+        now = datetime.now()
+        for f_name in ('_created', '_modified'):
+            f = self._fields.get(f_name)
+            if f is not None and f.default is not None:
+                f.default = now
+                f.rst_val(update_state=False)
+                f.is_modified = False
+
+        self._indexes = schema.indexes
+        self._has_text_index = schema.has_text_index
+
+    def _setup_schema(self):
+        """Setup fields and indexes by calling hooks and firing events
+        """
+        model = self._model
 
         # Define 'system' fields
         self.define_field(_field.ObjectId('_id', is_required=True))
@@ -330,42 +486,68 @@ class Entity(ABC):
         events.fire('odm@model.setup_indexes', entity=self)
         events.fire('odm@model.setup_indexes.{}'.format(model), entity=self)
 
-        # Load fields data from database or cache
-        if obj_id:
-            self._load_fields_data(ObjectId(obj_id) if isinstance(obj_id, str) else obj_id)
+        # Schema of a model which entities are not set up from it is still used as a read-only mock
+        if self._cache_schema or model not in _SCHEMAS:
+            _SCHEMAS[model] = Schema(self)
 
     def _load_fields_data(self, eid: ObjectId):
         """Load fields data from the database
         """
-        cache_key = '{}.{}'.format(self._model, eid)
+        self._fill_fields_data(self._load_data(eid))
 
+    def _load_data(self, eid: ObjectId) -> dict:
+        """Load entity's data from cache or database
+        """
         # Try to load entity data from cache
+        generation = _cache.get_generation(self._model)
         try:
-            data = _CACHE_POOL.get_hash(cache_key)
+            data = _cache.get_entity(self._model, eid, generation)
+            if data is None:
+                raise _error.EntityNotFound(self._model, str(eid))
 
         # Get entity data from database
         except cache.error.KeyNotExist:
-            data = self.collection.find_one({'_id': eid})
+            _metrics.incr('entity.db_load', self._model)
+            with _metrics.timer('entity.db_time', self._model):
+                data = self.collection.find_one({'_id': eid})
+
             if not data:
+                _cache.put_missing(self._model, eid, generation)
                 raise _error.EntityNotFound(self._model, str(eid))
 
             # Put loaded data into the cache
-            _CACHE_POOL.put_hash(cache_key, data, _CACHE_TTL)
+            _cache.put_entity(self._model, data, generation)
 
-        # Fill fields with values from loaded data
-        for f_name, f_value in data.items():
-            try:
-                field = self.get_field(f_name)
+        return data
 
-                # Fields that must not be overwritten
-                if f_name == '_model' or not field.is_storable:
-                    continue
+    def _fill_fields_data(self, data: dict, projection: dict = None):
+        """Fill fields with values from loaded data
 
-                field.uid = '{}.{}.{}'.format(self._model, eid, f_name)
-                field.set_storable_val(f_value)
-            except _error.FieldNotDefined:
-                # Fields definition may be changed from version to version, so just ignore non-existent fields
-                pass
+        If `projection` is specified, data is considered as loaded using it and fields excluded by it will be loaded
+        on first access.
+        """
+        if projection:
+            # Projection either includes or excludes fields
+            included = bool(next(iter(projection.values())))
+            self._unloaded_fields = {f.name for f in self._fields.values()
+                                     if f.is_storable and (f.name in projection) != included}
+
+        if self._lazy_fields_decoding:
+            # Fields values will be set on first access
+            self._raw_data = {k: v for k, v in data.items() if k != '_model'}
+        else:
+            for f_name, f_value in data.items():
+                try:
+                    field = self.get_field(f_name)
+
+                    # Fields that must not be overwritten
+                    if f_name == '_model' or not field.is_storable:
+                        continue
+
+                    field.set_storable_val(f_value)
+                except _error.FieldNotDefined:
+                    # Fields definition may be changed from version to version, so just ignore non-existent fields
+                    pass
 
         # In versions prior to 1.4 field '_ref' didn't exist, so we need to check it
         if not self.f_get('_ref'):
@@ -375,6 +557,32 @@ class Entity(ABC):
         self._is_new = False
         self._is_modified = False
 
+    def _decode_raw_data(self, field_name: str = None):
+        """Set values of fields from loaded raw data
+
+        If `field_name` is not specified, values of all fields are set.
+        """
+        if field_name:
+            items = ((field_name, self._raw_data.pop(field_name)),)
+        else:
+            items, self._raw_data = self._raw_data.items(), None
+
+        for f_name, f_value in items:
+            # Fields definition may be changed from version to version, so just ignore non-existent fields
+            field = self._fields.get(f_name)
+            if field and field.is_storable:
+                field.set_storable_val(f_value)
+
+    def _load_unloaded_fields(self):
+        """Load fields that were not loaded by a partial load
+        """
+        f_names, self._unloaded_fields = self._unloaded_fields, None
+        data = self._load_data(self.id)
+
+        for f_name in f_names:
+            if f_name in data:
+                self._fields[f_name].set_storable_val(data[f_name])
+
     def define_index(self, definition: List[Tuple], unique: bool = False, name: str = None):
         """Define an index(es)
         """
@@ -407,7 +615,8 @@ class Entity(ABC):
                 self._has_text_index = True
                 opts['language_override'] = 'language_db'
 
-        self._indexes.append((definition, opts))
+        # Indexes list may be shared with model's schema, so it must not be modified in place
+        self._indexes = self._indexes + [(definition, opts)]
 
     def define_field(self, field_obj: _field.Base):
         """Define a field
@@ -483,6 +692,12 @@ class Entity(ABC):
         if not self.has_field(field_name):
             raise _error.FieldNotDefined(self._model, field_name)
 
+        if self._unloaded_fields and field_name in self._unloaded_fields:
+            self._load_unloaded_fields()
+
+        if self._raw_data and field_name in self._raw_data:
+            self._decode_raw_data(field_name)
+
         return self._fields[field_name]
 
     def f_set(self, field_name: str, value, **kwargs):
@@ -755,7 +970,7 @@ class Entity(ABC):
         if kwargs.get('pre_hooks', True):
 
             history = {}
-            for f in self._fields.values():
+            for f in self.fields.values():
                 if f.is_modified:
                     # Call '_on_f_modified' hooks
                     self._on_f_modified(f.name, f.get_prev_val(), f.get_val())
@@ -772,10 +987,11 @@ class Entity(ABC):
             events.fire('odm@entity.pre_save.{}'.format(self._model), entity=self)
 
         # Save into storage
+        fields_data = self.as_storable()
         _queue.put('entity_save', {
             'is_new': self._is_new,
-            'collection_name': self._collection_name,
-            'fields_data': self.as_storable(),
+            'collection_name': self.collection_name,
+            'fields_data': fields_data,
         }).execute(True)
 
         # Saved entity cannot be 'new'
@@ -793,6 +1009,7 @@ class Entity(ABC):
             events.fire('odm@entity.save.{}'.format(self._model), entity=self, first_save=first_save)
 
         # Mark entity as saved and is not modified
+        modified_fields = [f.name for f in self._fields.values() if f.is_modified]
         self._is_being_saved = False
         self._is_modified = False
         for f in self._fields.values():
@@ -802,12 +1019,25 @@ class Entity(ABC):
         for child in self._pending_children:
             child.save(update_timestamp=False)
 
-        # Clear finder cache
+        # Keep identity map of current session coherent
         from . import _api
-        _api.clear_cache(self._model)
+        _api.session_put(self)
+
+        # Invalidate affected cache
+        if first_save:
+            self._invalidate_cache(fields_data)
+        else:
+            self._invalidate_cache(fields=modified_fields)
 
         return self
 
+    def _invalidate_cache(self, data: dict = None, fields: List[str] = ()):
+        """Invalidate finder cache entries and resolved references which could be affected by the entity's change
+        """
+        _cache.invalidate_entity(self._model, data, fields)
+        bump_version(self._model)
+        events.fire('odm@cache.clear', model=self._model)
+
     def _on_pre_save(self, **kwargs):
         """Pre save hook
         """
@@ -846,7 +1076,7 @@ class Entity(ABC):
         # Search for entities that refers to this entity
         if not kwargs.get('force'):
             for model in _api.get_registered_models():
-                for field in _api.dispense(model).fields.values():
+                for field in _api.get_schema(model).fields.values():
                     f = _api.find(model)
 
                     if not isinstance(field, (_field.Ref, _field.RefsList)):
@@ -871,7 +1101,7 @@ class Entity(ABC):
         self._is_being_deleted = True
 
         # Notify each field about entity deletion
-        for f_name, field in self._fields.items():
+        for f_name, field in self.fields.items():
             field.entity_delete(self)
 
         # Clear parent reference from orphaned children
@@ -881,12 +1111,15 @@ class Entity(ABC):
         # Actual deletion from the database and cache
         _queue.put('entity_delete', {
             'model': self._model,
-            'collection_name': self._collection_name,
+            'collection_name': self.collection_name,
             '_id': self.id,
         }).execute(True)
 
-        # Clear finder cache
-        _api.clear_cache(self._model)
+        # Keep identity map of current session coherent
+        _api.session_rm(self)
+
+        # Invalidate affected cache
+        self._invalidate_cache(self.as_storable(False))
 
         # After delete events and hook. It is important to call them BEFORE entity entity data will be
         # completely removed from the cache
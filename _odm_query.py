@@ -14,10 +14,11 @@ class ODMQuery(qu.Query):
     """Query
     """
 
-    def __init__(self, entity_mock: _model.Entity, ops: Union[qu.Operator, Iterator[qu.Operator]] = None):
+    def __init__(self, entity_mock: Union[_model.Entity, _model.Schema],
+                 ops: Union[qu.Operator, Iterator[qu.Operator]] = None):
         """Init
         """
-        # Mock entity to determine field types, etc
+        # Mock entity or model's schema to determine field types, etc
         self._entity_mock = entity_mock
 
         super().__init__(ops)
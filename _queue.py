@@ -6,11 +6,10 @@ __license__ = 'MIT'
 
 from pymongo.errors import PyMongoError
 from bson import errors as bson_errors
-from pytsite import mongodb, queue, logger, cache, reg
+from pytsite import mongodb, queue, logger
+from . import _cache
 
 _QUEUE = queue.Queue('odm')
-_ENTITIES_CACHE = cache.get_pool('odm.entities')
-_CACHE_TTL = reg.get('odm.cache_ttl', 86400)
 
 
 def _entity_save(args: dict):
@@ -30,8 +29,10 @@ def _entity_save(args: dict):
             collection.replace_one({'_id': fields_data['_id']}, fields_data)
 
         # Update cache
-        c_key = '{}.{}'.format(fields_data['_model'], fields_data['_id'])
-        _ENTITIES_CACHE.put_hash(c_key, fields_data, _CACHE_TTL)
+        _cache.put_entity(fields_data['_model'], fields_data)
+
+        # Other processes must be notified after new data is written, otherwise they could cache previous one again
+        _cache.publish_entity_change(fields_data['_model'], fields_data['_id'])
 
     except (bson_errors.BSONError, PyMongoError) as e:
         logger.error(e)
@@ -44,7 +45,7 @@ def _entity_delete(args: dict):
     mongodb.get_collection(args['collection_name']).delete_one({'_id': args['_id']})
 
     # Update cache
-    _ENTITIES_CACHE.rm('{}.{}'.format(args['model'], args['_id']))
+    _cache.rm_entity(args['model'], args['_id'])
 
 
 def put(op: str, args: dict) -> queue.Queue: